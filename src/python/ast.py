@@ -2,14 +2,22 @@
 # ast.py - This file includes the definition of syntax node
 #
 
-class TypeNode:
+class TypeNode(object):
     """
     This class represents the type node that represents type
 
     Note that types form an array that are represented as derived
     from a less complicated type (i.e. the type node in the next node)
+
+    Type objects do not store type nodes as objects of this class.
+    Instead they keep the fields of each type node in parallel lists
+    (see class Type), and the constants below are used as their values
     """
 
+    # Type nodes have a fixed set of attributes, so we do not
+    # need a per-instance dict
+    __slots__ = ("op", "type_spec", "data")
+
     # Here we define all possible type operations
     OP_FUNC_CALL = 1
     OP_ARRAY_SUB = 2
@@ -82,17 +90,46 @@ class Type:
     """
     This class represents type object which is an array of type nodes
     from the highest precedence to the lowest precedence
+
+    Type nodes are not stored as separate TypeNode objects. Instead
+    each field of the type node has its own list, and the i-th type
+    node consists of the i-th element of all these lists
     """
     def __init__(self):
         """
         Initialize a type node with an empty array and
         index being 0
         """
-        self.type_list = []
+        self.op_list = []
+        self.type_spec_list = []
+        self.data_list = []
         self.index = 0
 
         return
 
+    def __len__(self):
+        """
+        Returns the number of type nodes in the type
+
+        :return: int
+        """
+        return len(self.op_list)
+
+    def push_type_node(self, op, type_spec, data):
+        """
+        Appends a type node to the end of the type
+
+        :param op: The operation of the type node
+        :param type_spec: The type spec of the type node
+        :param data: The data of the type node
+        :return: None
+        """
+        self.op_list.append(op)
+        self.type_spec_list.append(type_spec)
+        self.data_list.append(data)
+
+        return
+
     def push_base_type(self, syntax_node, type_spec):
         """
         This function returns a base type given the syntax node that
@@ -117,13 +154,13 @@ class Type:
             # push it to the type list
             struct_type_list = NamedTypeList()
             struct_type_list.derive_struct_type(syntax_node)
-            self.type_list.append(TypeNode(TypeNode.OP_STRUCT,
-                                           type_spec,
-                                           struct_type_list))
+            self.push_type_node(TypeNode.OP_STRUCT,
+                                type_spec,
+                                struct_type_list)
             return
 
         # In all other cases just use the type and return
-        self.type_list.append(TypeNode(t, type_spec, None))
+        self.push_type_node(t, type_spec, None)
 
         return
 
@@ -146,7 +183,7 @@ class Type:
             else:
                 mask = 0x0
 
-            self.type_list.append(TypeNode(TypeNode.OP_DEREF, mask, None))
+            self.push_type_node(TypeNode.OP_DEREF, mask, None)
 
         return
 
@@ -189,13 +226,11 @@ class Type:
             if node.symbol == "T_ARRAY_SUB":
                 # Store the expression as AST inside the type node
                 if data_node.symbol == "T_":
-                    self.type_list.append(TypeNode(TypeNode.OP_ARRAY_SUB,
-                                                   None,
-                                                   None))
+                    self.push_type_node(TypeNode.OP_ARRAY_SUB, None, None)
                 else:
-                    self.type_list.append(TypeNode(TypeNode.OP_ARRAY_SUB,
-                                                   None,
-                                                   data_node))
+                    self.push_type_node(TypeNode.OP_ARRAY_SUB,
+                                        None,
+                                        data_node)
                 index += 2
             elif node.symbol == "T_FUNC_CALL":
                 if data_node.symbol == "T_":
@@ -205,9 +240,9 @@ class Type:
                     named_type_list = NamedTypeList()
                     named_type_list.derive_arg_type(data_node)
 
-                self.type_list.append(TypeNode(TypeNode.OP_FUNC_CALL,
-                                               None,
-                                               named_type_list))
+                self.push_type_node(TypeNode.OP_FUNC_CALL,
+                                    None,
+                                    named_type_list)
                 index += 2
 
         return ident_node
@@ -348,26 +383,102 @@ class NamedTypeList:
 
         return struct_ident
 
+#####################################################################
+# Syntax node symbol IDs
+#####################################################################
+
+# This is a list of syntax node symbols that we dispatch on when
+# processing the AST. Each symbol is assigned a small integer ID which
+# is its index in this list, such that dispatching could be done
+# by indexing a list rather than hashing the symbol string
+#
+# Type modifiers must come first, because get_type_modifier() relies
+# on their IDs being 0 to TYPE_MODIFIER_COUNT - 1
+SYMBOL_LIST = [
+    "T_CONST",
+    "T_VOLATILE",
+    "T_STATIC",
+    "T_REGISTER",
+    "T_EXTERN",
+    "T_UNSIGNED",
+    "T_AUTO",
+    "T_SIGNED",
+    "T_TYPEDEF",
+    "T_DECL",
+]
+
+# This maps the symbol string to its integer ID. Symbols that are not
+# in the list above do not have an ID, and their nodes use -1
+SYMBOL_ID = dict((symbol, symbol_id)
+                 for symbol_id, symbol in enumerate(SYMBOL_LIST))
+
+# Symbols after these are added by SyntaxNode.register_transform(),
+# and only their IDs could be released
+BUILTIN_SYMBOL_COUNT = len(SYMBOL_LIST)
+
+# Syntax nodes for terminals without token value are all identical
+# for the same symbol, so we share one instance per symbol instead of
+# allocating a new one for each occurrence. See
+# SyntaxNode.get_or_make()
+TERMINAL_NODE_POOL = {}
+
 #####################################################################
 # class SyntaxNode
 #####################################################################
 
-class SyntaxNode:
+class SyntaxNode(object):
     """
     This is the syntax node we use for demonstrating the parser's
     parsing process
     """
+
+    # Since there is one syntax node per symbol in the source
+    # we store attributes in fixed slots instead of a per-instance
+    # dict, which saves memory and makes attribute access faster
+    __slots__ = ("symbol",
+                 "symbol_id",
+                 "_transform",
+                 "has_transformable",
+                 "child_transform_list",
+                 "child_list",
+                 "data",
+                 "parent")
     def __init__(self, symbol):
         """
         Initialize the node with a symbol. The symbol could be
         either terminal or non-terminal
 
-        :param symbol: The symbol of this syntax node
+        Since there is one node for every symbol in the source,
+        this is kept as cheap as possible. In particular the type of
+        the symbol is only checked if __debug__ is set, i.e. Python is
+        not run with -O
+
+        :param symbol: The symbol of this syntax node (str)
         """
-        # Must be a string or unicode type
-        assert(isinstance(symbol, str))
+        if __debug__:
+            assert(isinstance(symbol, str))
+
+        # This is the integer ID of the symbol which we compute only
+        # once here, or -1 if the symbol is never dispatched on
+        symbol_id = SYMBOL_ID.get(symbol, -1)
 
         self.symbol = symbol
+        self.symbol_id = symbol_id
+        # This is the routine that transforms this node, which is
+        # also looked up only once here. None if there is not one
+        if symbol_id >= 0:
+            self._transform = TRANSFORM_TABLE[symbol_id]
+        else:
+            self._transform = None
+
+        # Whether this node or any node in its subtree has a transform
+        # routine. This is updated when child nodes are added, and
+        # transform_ast() skips subtrees where it is False
+        self.has_transformable = self._transform is not None
+        # Indices of child nodes that have has_transformable set in
+        # ascending order, or None if there is not any
+        self.child_transform_list = None
+
         # These are child nodes that appear as derived nodes
         # in the syntax specification
         self.child_list = []
@@ -383,14 +494,205 @@ class SyntaxNode:
 
         return
 
+    @staticmethod
+    def get_or_make(symbol, data=None):
+        """
+        Returns a syntax node for a terminal symbol. If there is no
+        token value then the node is shared by all occurrences of
+        the symbol, and therefore the caller must not add children,
+        token value or parent to it. Nodes with token value are
+        always newly created
+
+        :param symbol: The symbol of the terminal
+        :param data: The optional token value
+        :return: SyntaxNode
+        """
+        if data is not None:
+            node = SyntaxNode(symbol)
+            node.data = data
+            return node
+
+        node = TERMINAL_NODE_POOL.get(symbol, None)
+        if node is None:
+            node = SyntaxNode(symbol)
+            TERMINAL_NODE_POOL[symbol] = node
+
+        return node
+
+    @staticmethod
+    def register_transform(symbol, func, root=None):
+        """
+        Registers a routine for transforming syntax nodes of the
+        given symbol. If the symbol does not have an ID yet then a
+        new one is allocated for it
+
+        Since the routine is bound to a node when the node is
+        constructed, nodes that already exist are not affected unless
+        they are in the tree passed as root, in which case they are
+        bound to the new routine as well
+
+        :param symbol: The symbol of syntax nodes to transform
+        :param func: The transform routine
+        :param root: Optional root of an existing AST
+        :return: None
+        """
+        symbol_id = SYMBOL_ID.get(symbol, None)
+        if symbol_id is None:
+            symbol_id = len(SYMBOL_LIST)
+            SYMBOL_LIST.append(symbol)
+            SYMBOL_ID[symbol] = symbol_id
+            TRANSFORM_TABLE.append(func)
+        else:
+            TRANSFORM_TABLE[symbol_id] = func
+
+        TRANSFORM_DICT[symbol] = func
+        # Shared terminal nodes were bound to the old routine
+        TERMINAL_NODE_POOL.pop(symbol, None)
+
+        if root is not None:
+            SyntaxNode.rebind_transform(root)
+
+        return
+
+    @staticmethod
+    def unregister_transform(symbol, root=None):
+        """
+        Removes the routine registered for the given symbol. If the
+        symbol is the last one that register_transform() allocated an
+        ID for then the ID is released as well, which undoes the
+        registration exactly
+
+        Nodes in the tree passed as root are unbound from the routine
+
+        :param symbol: The symbol of syntax nodes
+        :param root: Optional root of an existing AST
+        :return: None
+        """
+        symbol_id = SYMBOL_ID[symbol]
+        del TRANSFORM_DICT[symbol]
+        if symbol_id >= BUILTIN_SYMBOL_COUNT and \
+           symbol_id == len(SYMBOL_LIST) - 1:
+            SYMBOL_LIST.pop()
+            del SYMBOL_ID[symbol]
+            TRANSFORM_TABLE.pop()
+        else:
+            TRANSFORM_TABLE[symbol_id] = None
+
+        TERMINAL_NODE_POOL.pop(symbol, None)
+
+        if root is not None:
+            SyntaxNode.rebind_transform(root)
+
+        return
+
+    @staticmethod
+    def rebind_transform(root):
+        """
+        Binds all nodes in the tree to the routines currently in the
+        transform table, and then recomputes which subtrees have
+        something to transform. Children that are not syntax nodes
+        (e.g. tokens) are skipped
+
+        :param root: The root of an existing AST
+        :return: None
+        """
+        # Collect nodes such that parents come before children
+        node_list = []
+        stack = [root]
+        while len(stack) != 0:
+            node = stack.pop()
+            if isinstance(node, SyntaxNode) is False:
+                continue
+
+            symbol_id = SYMBOL_ID.get(node.symbol, -1)
+            node.symbol_id = symbol_id
+            if symbol_id >= 0:
+                node._transform = TRANSFORM_TABLE[symbol_id]
+            else:
+                node._transform = None
+
+            node_list.append(node)
+            stack.extend(node.child_list)
+
+        # Then recompute the flag and the indices from the bottom up,
+        # since children are always visited before their parent in
+        # reversed order
+        for node in reversed(node_list):
+            node.set_child_list(node.child_list)
+
+        return
+
+    def set_child_list(self, child_list):
+        """
+        Sets the child list to the given list
+
+        The list is used as it is and is not copied. Children that
+        are not syntax nodes (e.g. tokens) are never transformed
+
+        :param child_list: A list of child nodes
+        :return: None
+        """
+        self.child_list = child_list
+
+        index_list = [index for index, child in enumerate(child_list)
+                      if getattr(child, "has_transformable", False) is True]
+        if len(index_list) == 0:
+            index_list = None
+
+        self.child_transform_list = index_list
+        self.has_transformable = \
+            self._transform is not None or index_list is not None
+
+        return
+
     def append(self, symbol):
         """
         Append a new symbol into the child list
 
-        :param symbol: Terminal or NonTerminal
+        :param symbol: The child SyntaxNode
         :return: None
         """
+        if __debug__:
+            assert(isinstance(symbol, SyntaxNode))
+
+        if symbol.has_transformable is True:
+            if self.child_transform_list is None:
+                self.child_transform_list = [len(self.child_list)]
+            else:
+                self.child_transform_list.append(len(self.child_list))
+            self.has_transformable = True
+
         self.child_list.append(symbol)
+
+        return
+
+    def extend_children(self, symbol_list):
+        """
+        Append a list of new symbols into the child list. This is
+        faster than calling append() for each of them
+
+        :param symbol_list: A list of child SyntaxNode objects
+        :return: None
+        """
+        if __debug__:
+            for symbol in symbol_list:
+                assert(isinstance(symbol, SyntaxNode))
+
+        child_list = self.child_list
+
+        start = len(child_list)
+        index_list = [start + index
+                      for index, symbol in enumerate(symbol_list)
+                      if symbol.has_transformable is True]
+
+        child_list.extend(symbol_list)
+        if len(index_list) != 0:
+            if self.child_transform_list is None:
+                self.child_transform_list = index_list
+            else:
+                self.child_transform_list.extend(index_list)
+            self.has_transformable = True
+
         return
 
     def __getitem__(self, item):
@@ -490,6 +792,12 @@ TYPE_MODIFIER_AUTO = TYPE_MODIFIER_DICT["T_AUTO"]
 TYPE_MODIFIER_SIGNED = TYPE_MODIFIER_DICT["T_SIGNED"]
 TYPE_MODIFIER_TYPEDEF = TYPE_MODIFIER_DICT["T_TYPEDEF"]
 
+# Type modifiers have the lowest symbol IDs, so the mask of a
+# modifier node could be found by indexing this list with its ID
+TYPE_MODIFIER_COUNT = len(TYPE_MODIFIER_DICT)
+TYPE_MODIFIER_MASK_BY_ID = [TYPE_MODIFIER_DICT[symbol]
+                            for symbol in SYMBOL_LIST[:TYPE_MODIFIER_COUNT]]
+
 def get_type_modifier(child_list):
     """
     This function returns a bit set that identifies the type
@@ -508,11 +816,10 @@ def get_type_modifier(child_list):
     type_modifier_mask = 0x00000000
 
     for spec in child_list:
-        # It must exist otherwise the parsing is wrong
-        spec_mask = TYPE_MODIFIER_DICT.get(spec.symbol, None)
-        # Then it is a type name because it does not belong to
-        # any of the specifiers we have seen
-        if spec_mask is None:
+        symbol_id = spec.symbol_id
+        # If the ID is not a modifier's then it is a type name because
+        # it does not belong to any of the specifiers we have seen
+        if symbol_id < 0 or symbol_id >= TYPE_MODIFIER_COUNT:
             if base_type_node is not None:
                 raise TypeError("Could not specify" +
                                 " more than one type in a" +
@@ -521,6 +828,7 @@ def get_type_modifier(child_list):
 
             base_type_node = spec
         else:
+            spec_mask = TYPE_MODIFIER_MASK_BY_ID[symbol_id]
             # If the modifier has already been seen then this is
             # an error also
             if (type_modifier_mask & spec_mask) != 0x00000000:
@@ -545,9 +853,9 @@ def transform_type_decl(decl_root):
     optionally None object
 
     :param decl_root: The T_DECL node
-    :return: SyntaxNode, bool
+    :return: SyntaxNode
     """
-    return decl_root, True
+    return decl_root
     decl_spec = decl_root.child_list[0]
     if len(decl_root.child_list) == 2:
         init_decl_list = decl_root.child_list[1]
@@ -558,7 +866,6 @@ def transform_type_decl(decl_root):
     # as well as the bit set on type specifiers
     type_modifier_mask, base_type_node = \
         get_type_modifier(decl_spec.child_list)
-    print base_type_node.symbol
 
     # If we did not find the base type then throw error
     if base_type_node is None:
@@ -576,13 +883,13 @@ def transform_type_decl(decl_root):
         new_node = SyntaxNode(decl_root.symbol)
         new_node.data = (base_type_node, type_modifier_mask)
 
-        return new_node, False
+        return new_node
 
     # For each declarator + init in the list we do the same processing
     for init_decl in init_decl_list:
         pass
 
-    return decl_root, True
+    return decl_root
 
 #####################################################################
 # The following is the driver for transformation
@@ -594,11 +901,27 @@ def transform_type_decl(decl_root):
 #
 # The return value of the function should be also a
 # syntax node object, and it will be used to replace
-# the node we passed to the function
+# the node we passed to the function. If the function returns
+# the same node then its child nodes are also transformed; If
+# it returns a different node then the subtree has been replaced
+# and the children of the new node are not transformed
 TRANSFORM_DICT = {
     "T_DECL": transform_type_decl,
 }
 
+# This is the same mapping as TRANSFORM_DICT but indexed using
+# the symbol ID of the syntax node. Symbols without a transform
+# routine have None in their slot. Syntax nodes look up their
+# routine in this table once when they are constructed
+#
+# Use SyntaxNode.register_transform() to add routines after this
+# module has been loaded, which keeps both tables consistent
+TRANSFORM_TABLE = [TRANSFORM_DICT.get(symbol, None)
+                   for symbol in SYMBOL_LIST]
+
+# Every symbol with a transform routine must have been given an ID
+assert(all(symbol in SYMBOL_ID for symbol in TRANSFORM_DICT))
+
 def transform_ast(root):
     """
     This function traverses the AST using pre-order traversal
@@ -609,67 +932,104 @@ def transform_ast(root):
     in a very deep AST, we maintain a stack manually in this function
     and emulate recursion using the stack
 
-    The return value also indicates whether we need to transform
-    the child node of the current node after it has been transformed.
-    If the returned boolean is False then we do not attempt to
-    transform its child nodes; Otherwise we continue with its child
+    The return value of a transform routine also indicates whether we
+    need to transform the child node of the current node after it has
+    been transformed. If the routine returns the node passed to it
+    then we continue with its child; Otherwise the returned node
+    replaces the current node and we do not attempt to transform
+    its child nodes. This way routines do not need to allocate a
+    tuple to return a flag together with the node
+
+    Only children whose indices are in child_transform_list of their
+    parent are visited, so routines that add children to the node
+    passed to them must use append() or set_child_list()
 
     :param root: The root of the AST
-    :return: root (may have been changed), bool
+    :return: root (may have been changed)
     """
-    # This stores tuple: (child list, index)
+    # This stores the child list, the list of child indices to visit,
+    # its length and the position of the next one in it for every
+    # level above the current one. They are pushed as separate
+    # elements rather than a tuple such that descending into a node
+    # does not allocate any object
     stack = []
-
-    # To keep consistency we pretend that the root also comes
-    # from a child list of only one element that is the root
-    root_child_list = [root]
-
-    current_child_list = root_child_list
-    current_index = 0
-    current_level = 0
+    # Bind the methods once since they are called for every level
+    # of the tree in the loop below
+    push = stack.append
+    pop = stack.pop
+
+    # The root is transformed first, since it is not in any child
+    # list and therefore could not be replaced in the loop below
+    if root.has_transformable is False:
+        return root
+
+    func = root._transform
+    if func is not None:
+        new_root = func(root)
+        if new_root is not root:
+            return new_root
+
+    # These are indices of children in the list that have something
+    # to transform in ascending order. Other children are never touched
+    current_index_list = root.child_transform_list
+    if current_index_list is None:
+        return root
+
+    current_child_list = root.child_list
+    # Routines only replace nodes in the child list, so the index
+    # list does not change while we visit it and its length is
+    # computed only once per level
+    current_count = len(current_index_list)
+    current_pos = 0
 
     while True:
         # While there is still a node to transform in the child list
-        while current_index < len(current_child_list):
-            current_node = current_child_list[current_index]
-            func = TRANSFORM_DICT.get(current_node.symbol, None)
+        while current_pos < current_count:
+            current_index = current_index_list[current_pos]
+            current_pos += 1
 
-            # Enable this to check we are traversing in the
-            # correct order (i.e. pre-order)
-            #print " " * current_level + current_node.symbol
+            current_node = current_child_list[current_index]
+            # This is bound when the node is constructed
+            func = current_node._transform
 
             # If the current node has something to transform
             if func is not None:
-                new_node, transform_child = func(current_node)
-                # Update the node into the child list
+                new_node = func(current_node)
+                # If the node has been replaced then update the
+                # node into the child list and do not descend
                 # Note that the child list is just a reference
                 # so we could update it directly and the change will be
                 # reflected into the syntax node
-                current_child_list[current_index] = new_node
-            else:
-                # Otherwise we must continue transforming the children
-                # of the current node
-                transform_child = True
-
-            # If transform child is True then just append the current
-            # index into the stack and start a new instance
-            if transform_child is True:
-                stack.append((current_child_list, current_index + 1))
-                current_child_list = current_node.child_list
-                current_index = 0
-                current_level += 1
+                if new_node is not current_node:
+                    current_child_list[current_index] = new_node
+                    continue
+
+            # Otherwise we must continue transforming the children
+            # of the current node, so just push the remaining
+            # children into the stack and start a new instance
+            index_list = current_node.child_transform_list
+            if index_list is None:
                 continue
-            else:
-                current_index += 1
+
+            push(current_child_list)
+            push(current_index_list)
+            push(current_count)
+            push(current_pos)
+            current_child_list = current_node.child_list
+            current_index_list = index_list
+            current_count = len(index_list)
+            current_pos = 0
 
         # If the stack is empty which means we have finished transforming all
         # nodes, then just return the new root node
-        if len(stack) == 0:
+        if not stack:
             break
         else:
             # Just finished the current node's children, need to
             # go up one level and continue
-            current_child_list, current_index = stack.pop()
-            current_level -= 1
+            current_pos = pop()
+            current_count = pop()
+            current_index_list = pop()
+            current_child_list = pop()
 
-    return root_child_list[0]
+    return root
@@ -5,18 +5,37 @@
 # SLR(1) and LALR(1), and an on-line Earley parser to experiment
 # with
 #
+# A note on performance: grammar analysis is bound by hashing,
+# attribute lookups and object allocation rather than arithmetic,
+# so there is no data parallel kernel to vectorize. What pays off
+# is data layout and avoiding repeated work:
+#   - Symbol sets are masks of terminal IDs (Terminal.mask)
+#   - Symbols are interned and compared by identity
+#   - FIRST/FOLLOW run on flattened productions, and FIRST visits
+#     strongly connected components in dependency order
+#   - LR parsing tables could be cached on disk (--cache)
+#
 
+from __future__ import print_function
 from common import *
 import sys
 import json
+import pickle
+import hashlib
+import collections
+import random
+import os
+import shutil
+import tempfile
 from lex import CTokenizer, Token
-from ast import SyntaxNode
+from ast import SyntaxNode, transform_ast
+from ast import SYMBOL_LIST, SYMBOL_ID, TRANSFORM_TABLE, TRANSFORM_DICT
 
 #####################################################################
 # class Symbol
 #####################################################################
 
-class Symbol:
+class Symbol(object):
     """
     This class represents a grammar symbol that is either a terminal
     or non-terminal
@@ -26,6 +45,12 @@ class Symbol:
     name is a macro defined in another CPP file, which is also used
     by the lex to produce the token stream; For terminals their names
     are only used internally by this generator and parser code
+
+    There is only one symbol object for each name (terminals are
+    obtained using Terminal.intern(), and non-terminals are kept in
+    the symbol dict of the parser generator), so symbols are compared
+    by their identity. This must be a new-style class, because for
+    old-style instances without __eq__ even == is a slow lookup
     """
 
     # This is the name of the "eps" symbol
@@ -71,34 +96,18 @@ class Symbol:
     def __hash__(self):
         """
         Hashes the object into a hash code. Note that we compute the
-        hash using the name, so each name should be unique no matter
-        whether it is terminal or non-terminal
+        hash using the name rather than the identity, such that the
+        order of iterating over sets of symbols does not change
+        between runs
 
-        This is defined for making terminals and non-terminals hashable,
-        such that we could use them in a hash or set structure
+        Equality is not defined and therefore symbols are compared
+        by identity, which is consistent with the hash code since
+        there is only one symbol for each name
 
         :return: hash code
         """
         return hash(self.name)
 
-    def __eq__(self, other):
-        """
-        Check whether two objects are the same
-
-        :param other: The other object to compare against
-        :return: bool
-        """
-        return self.name == other.name
-
-    def __ne__(self, other):
-        """
-        Check whether two objects are not the same
-
-        :param other: The other object to compare against
-        :return: bool
-        """
-        return self.name != other.name
-
     def __lt__(self, other):
         """
         Check whether the current symbol has a name that is
@@ -109,25 +118,16 @@ class Symbol:
         """
         return self.name < other.name
 
-    def is_symbol(self):
-        """
-        Checks whether the item is either a terminal or a
-        non-terminal
-
-        :return: bool
-        """
-        return self.is_terminal() is True or \
-               self.is_non_terminal() is True
-
     def is_terminal(self):
         """
         Whether the node is a terminal object. This function should not
-        be overloaded by the derived class, because it checks the class
-        type here directly
+        be overloaded by the derived class. The flag is set by the
+        constructor of the derived class rather than checking the class
+        type on every call
 
         :return: bool
         """
-        return isinstance(self, Terminal)
+        return self._is_terminal
 
     def is_non_terminal(self):
         """
@@ -136,19 +136,17 @@ class Symbol:
 
         :return: bool
         """
-        return isinstance(self, NonTerminal)
+        return not self._is_terminal
 
     def is_empty(self):
         """
         Whether the symbol node is empty terminal, i.e. "eps" in classical
         representations. "eps" is nothing more than a terminal of a special
-        name "T_", which could either be shared or a newly created one.
+        name "T_", and there is only one such terminal object
 
         :return: bool
         """
-        # Note that empty node must also be terminal node
-        return self.is_terminal() and \
-               self.name == Symbol.EMPTY_SYMBOL_NAME
+        return self is Symbol.EMPTY_SYMBOL
 
     @staticmethod
     def get_empty_symbol():
@@ -158,10 +156,7 @@ class Symbol:
         the result returned by this function as it will affect all
         objects
 
-        Instead of calling this function users could also create their
-        own instance of empty symbol using the name "T_". There is no
-        difference between creating a new instance and using the shared
-        instance (the latter saves memory, though)
+        Terminal.intern("T_") returns the same object
 
         :return: Terminal
         """
@@ -187,6 +182,42 @@ class Symbol:
         """
         return Symbol.ROOT_SYMBOL
 
+    @staticmethod
+    def expand_symbol_set(mask):
+        """
+        Returns the list of terminals in a symbol set mask. The list
+        is ordered by terminal ID
+
+        FIRST, FOLLOW and lookahead sets are represented as integers,
+        where bit i is set if the terminal with ID i is in the set
+
+        :param mask: The symbol set mask
+        :return: list(Terminal)
+        """
+        terminal_list = Terminal.TERMINAL_LIST
+
+        return [terminal_list[terminal_id]
+                for terminal_id in Symbol.expand_symbol_id(mask)]
+
+    @staticmethod
+    def expand_symbol_id(mask):
+        """
+        Returns the list of terminal IDs in a symbol set mask in
+        ascending order. This is used when only the IDs are needed,
+        e.g. as indices into tables
+
+        :param mask: The symbol set mask
+        :return: list(int)
+        """
+        ret = []
+        while mask != 0:
+            # Take the lowest bit and remove it from the mask
+            low_bit = mask & -mask
+            mask ^= low_bit
+            ret.append(low_bit.bit_length() - 1)
+
+        return ret
+
 #####################################################################
 # class Terminal
 #####################################################################
@@ -195,16 +226,55 @@ class Terminal(Symbol):
     """
     This class represents a terminal symbol object
     """
+
+    # This maps terminal IDs to terminal objects, and the following
+    # maps terminal names to IDs. IDs are shared by all terminals of
+    # the same name, so symbol set masks from different objects could
+    # be combined
+    TERMINAL_LIST = []
+    TERMINAL_ID_DICT = {}
+
     def __init__(self, name):
         """
         Initialize the terminal object
 
+        Use Terminal.intern() instead of calling this directly, since
+        there could only be one terminal object for each name
+
         :param name: The name of the macro that defines the terminal
         """
         Symbol.__init__(self, name)
+        self._is_terminal = True
+
+        assert(name not in Terminal.TERMINAL_ID_DICT)
+
+        # The empty symbol and the end symbol are created first
+        # and therefore have ID 0 and 1 respectively
+        terminal_id = len(Terminal.TERMINAL_LIST)
+        Terminal.TERMINAL_LIST.append(self)
+        Terminal.TERMINAL_ID_DICT[name] = terminal_id
+
+        self.id = terminal_id
+        # This is the bit of this terminal in symbol set masks
+        self.mask = 1 << terminal_id
 
         return
 
+    @staticmethod
+    def intern(name):
+        """
+        Returns the terminal object of the given name. A new object
+        is created if there is not one
+
+        :param name: The name of the macro that defines the terminal
+        :return: Terminal
+        """
+        terminal_id = Terminal.TERMINAL_ID_DICT.get(name, None)
+        if terminal_id is None:
+            return Terminal(name)
+
+        return Terminal.TERMINAL_LIST[terminal_id]
+
     def __repr__(self):
         """
         Returns a string representation of the object that could
@@ -237,6 +307,7 @@ class NonTerminal(Symbol):
         :param name: The name of the non-terminal
         """
         Symbol.__init__(self, name)
+        self._is_terminal = False
 
         # This is a set of production objects that this symbol
         # appears on the right hand side
@@ -247,12 +318,20 @@ class NonTerminal(Symbol):
         # This is the set of productions that this symbol appears
         # as the left hand side
         self.lhs_set = set()
+        # The same productions in the order they are added, for
+        # iterating over pairs of them without making a list each time
+        self.lhs_list = []
 
         # These two are FIRST() and FOLLOW() described in
         # predictive parsers
-        # They will be computed using recursion + memorization
-        self.first_set = set()
-        self.follow_set = set()
+        # They are computed by ParserGenerator.process_first_follow()
+        # Both are masks of terminal IDs (see Terminal.mask)
+        self.first_set = 0
+        self.follow_set = 0
+
+        # Whether the empty symbol is in the FIRST set, which is
+        # also set by ParserGenerator.process_first_follow()
+        self.nullable = False
 
         # This is the set of all possible symbols if we expand the
         # non-terminal
@@ -262,8 +341,18 @@ class NonTerminal(Symbol):
         #  S -> V1 V2 V3
         #  V1 -> V4 V5
         #  V4 -> S V6
+        # It is a mask in which non-terminal i is bit i, where i is
+        # the ID below. It is computed by
+        # ParserGenerator.process_first_rhs_set()
         self.first_rhs_set = None
 
+        # This is the index of the non-terminal in masks and tables
+        # over non-terminals of the generator. Unlike terminal IDs it
+        # is assigned by ParserGenerator.assign_non_terminal_id(),
+        # since the set of non-terminals changes while the grammar
+        # is being transformed
+        self.id = -1
+
         # This is used to generate name for a new node
         self.new_name_index = 1
         # This is for derived names, e.g. from left recursion elimination
@@ -272,26 +361,15 @@ class NonTerminal(Symbol):
         # derived node
         self.name_derived_from = self
 
-        # This is used to compute the FIRST and FOLLOW
-        # Since we always do these two recursively and iteratively
-        # for each iteration we mark the result to True after
-        # results are computed, and clear the flag to enable recomputing
-        # between different iterations
-        self.result_available = False
-
         return
 
     def get_first_length(self):
         """
-        This function returns the length of the FIRST set. If it is
-        None then return 0
+        This function returns the length of the FIRST set
 
         :return: int
         """
-        if self.first_set is None:
-            return 0
-
-        return len(self.first_set)
+        return bin(self.first_set).count("1")
 
     def get_follow_length(self):
         """
@@ -299,167 +377,7 @@ class NonTerminal(Symbol):
 
         :return: int
         """
-        if self.follow_set is None:
-            return 0
-
-        return len(self.follow_set)
-
-    def clear_result_available(self):
-        """
-        This function clears the result available flag
-
-        :return: None
-        """
-        self.result_available = False
-
-        return
-
-    def compute_first(self, path_list):
-        """
-        This function computes the FIRST set for the non-terminal
-
-        We use a recursive algorithm to compute the first set. This
-        process is similar to the one we use to compute the first
-        RHS set, but in this case since we care about not only
-        the formation but also semantic meaning of production rules,
-        we also need to consider the EMPTY SYMBOL
-
-        :return: None
-        """
-        # If we have already processed this node then return
-        if self.result_available is True:
-            return
-        else:
-            self.result_available = True
-
-        # This even works for left-recursive grammar
-        # because we may also use this for LR
-        if self in path_list:
-            return
-
-        path_list.append(self)
-
-        # For all productions A -> B1 B2 .. Bi
-        # FIRST(A) is defined as FIRST(B1) union FIRST(Bj)
-        # where B1 - Bj - 1 could derive terminal and
-        # Bj could not
-        for p in self.lhs_set:
-            for symbol in p.rhs_list:
-                # For terminals just add it and process
-                # the next production
-                if symbol.is_terminal() is True:
-                    # Empty symbol is also added here if it
-                    # is derived
-                    self.first_set.add(symbol)
-
-                    # Also add it into the production
-                    p.first_set.add(symbol)
-
-                    break
-
-                # Recursively compute the FIRST set
-                # Since we have processed the symbol == self case here we
-                # could call this without checking
-                symbol.compute_first(path_list)
-                self.first_set = \
-                    self.first_set.union(symbol.first_set)
-
-                # This could contain empty symbol
-                p.first_set = \
-                    p.first_set.union(symbol.first_set)
-
-                # If the empty symbol could not be derived then
-                # we do not check the following non-terminals
-                if Symbol.get_empty_symbol() not in symbol.first_set:
-                    break
-            else:
-                # This is executed if all symbols are non-terminal
-                # and they could all derive empty string
-                p.first_set.add(Symbol.get_empty_symbol())
-                self.first_set.add(Symbol.get_empty_symbol())
-
-        path_list.pop()
-
-        return
-
-    def compute_follow(self, path_list):
-        """
-        This functions computes the FOLLOW set. Note that the FOLLOW set
-        is also computed recursively, and therefore we use memorization
-        to compute it
-
-        Note that this should be run for multiple rounds for correctness
-        until no symbol could be added
-
-        :return: None
-        """
-        # If we are seeking for this node's FOLLOW set and then recursively
-        # reached the same node then there must by cyclic grammar:
-        #   A -> a B
-        #   B -> b C
-        #   C -> c A
-        # In this case if we compute FOLLOW(A) then we will compute FOLLOW(C)
-        # and FOLLOW(B) which comes back to FOLLOW(A)
-        #
-        # However this structure is very common in left recursion removal:
-        #   A -> A a | b
-        #   ---
-        #   A  -> b A'
-        #   A' -> eps | a A'
-        # When we compute FOLLOW(A') it is inevitable that this will happen
-
-        # This is how memorization works
-        if self.result_available is True:
-            return
-        else:
-            self.result_available = True
-
-        if self in path_list:
-            return
-
-        path_list.append(self)
-
-        # For all productions where this terminal appears as a symbol
-        for p in self.rhs_set:
-            # We allow one symbol to appear in a production for multiple
-            # times because that is how for() loop is defined
-            index_list = p.get_symbol_index(self)
-
-            for index in index_list:
-                # If the symbol appears as the last one in the production
-                if index == (len(p.rhs_list) - 1):
-                    # This could be a self recursion but we have prevented this
-                    # at the beginning of this function
-                    p.lhs.compute_follow(path_list)
-
-                    self.follow_set = \
-                        self.follow_set.union(p.lhs.follow_set)
-                else:
-                    # Compute the FIRST set for the substring after the
-                    # terminal symbol
-                    substr_first_set = p.compute_substring_first(index + 1)
-
-                    # If the string after the non-terminal could be
-                    # empty then we also need to add the FOLLOW of the LHS
-                    if Symbol.get_empty_symbol() in substr_first_set:
-                        p.lhs.compute_follow(path_list)
-                        self.follow_set = \
-                            self.follow_set.union(p.lhs.follow_set)
-
-                        # Remove the empty symbol because empty could not
-                        # appear in FOLLOW set
-                        substr_first_set.remove(Symbol.get_empty_symbol())
-
-                    # At last, merge the FIRST() without empty symbol
-                    # into the current FOLLOW set
-                    self.follow_set = \
-                        self.follow_set.union(substr_first_set)
-
-        # Do not forget to remove this in the path set (we know
-        # it does not exist before entering this function)
-        path_list.pop()
-
-        return
+        return bin(self.follow_set).count("1")
 
     def get_new_symbol(self):
         """
@@ -540,7 +458,7 @@ class NonTerminal(Symbol):
         for key, value in d.items():
             if len(value) == 1:
                 continue
-            elif key == self:
+            elif key is self:
                 # This should be processed by left recursion
                 continue
 
@@ -562,7 +480,7 @@ class NonTerminal(Symbol):
                 if len(p.rhs_list) == 1:
                     Production(p.pg,
                                new_nt,
-                               [Symbol.get_empty_symbol()])
+                               [EPS])
                 else:
                     Production(p.pg, new_nt, p.rhs_list[1:])
 
@@ -592,48 +510,39 @@ class NonTerminal(Symbol):
         if self.exists_direct_left_recursion() is False:
             return False
 
-        # Make a backup here because LHS set will be cleared
-        # A shallow copy is sufficient here because we just use
-        # LHS and RHS references
-        p_set = self.lhs_set.copy()
-
-        # This is the set of productions with left recursion
-        alpha_set = set()
-        # This is the set of productions without left recursion
-        beta_set = set()
-
-        pg = None
-        # Clear all productions - Note here we could not iterate on
-        # self.lhs because it will be changed in the iteration body
-        for p in p_set:
-            # This removes the production from this object
-            # and also removes it from other RHS objects
-            p.clear()
+        # This is the list of productions with left recursion
+        alpha_list = []
+        # This is the list of productions without left recursion
+        beta_list = []
 
-            # If this is a left recursion production then add
-            # it to alpha set; otherwise to beta set
-            if p[0] == self:
-                alpha_set.add(p)
+        # Partition the LHS set in one pass. The two lists also serve
+        # as the backup of the set which is emptied below
+        for p in self.lhs_set:
+            if p[0] is self:
+                alpha_list.append(p)
             else:
-                beta_set.add(p)
+                beta_list.append(p)
 
-            # Check they all come from the same pg instance
-            if pg is None:
-                pg = p.pg
-            else:
-                assert(id(pg) == id(p.pg))
+        # All productions of a symbol come from the same pg instance,
+        # and there is at least one left recursive production
+        pg = alpha_list[0].pg
+
+        # Clear all productions. This removes the production from
+        # this object and also removes it from other RHS objects
+        for p in alpha_list:
+            p.clear()
+        for p in beta_list:
+            p.clear()
 
         # It must have been cleared
         assert(len(self.lhs_set) == 0)
-        assert(len(alpha_set) + len(beta_set) == len(p_set))
 
         # Create a new symbol and add it into the set
         new_symbol = self.get_new_symbol()
         pg.non_terminal_set.add(new_symbol)
 
-        empty_symbol = Symbol.get_empty_symbol()
-        # Also add this into pg's terminal set
-        pg.terminal_set.add(empty_symbol)
+        # Also add the empty symbol into pg's terminal set
+        pg.terminal_set.add(EPS)
 
         # The scheme goes as follows:
         #   For a left recursion like this:
@@ -646,7 +555,7 @@ class NonTerminal(Symbol):
         # There is one exception: if bj is empty string then we
         # just ignore it and add A -> A' instead
 
-        for beta in beta_set:
+        for beta in beta_list:
             # Special case:
             # # If it is "A -> A a1 | A a2 | eps | B1 | B2" then
             # we make it
@@ -655,27 +564,27 @@ class NonTerminal(Symbol):
             # As long as A', B1 B2 does not have common FIRST() element
             # we are still safe
             if len(beta.rhs_list) == 1 and \
-               beta.rhs_list[0] == Symbol.get_empty_symbol():
+               beta.rhs_list[0] is EPS:
                 rhs_list = []
             else:
-                # Make a copy to avoid directly modifying the list
-                rhs_list = beta.rhs_list[:]
+                # RHS lists are tuples, so make a list we could extend
+                rhs_list = list(beta.rhs_list)
 
             rhs_list.append(new_symbol)
 
             # Add production: A -> bj A'
             Production(pg, self, rhs_list)
 
-        for alpha in alpha_set:
-            # Make a slice (which is internally a shallow copy)
-            rhs_list = alpha.rhs_list[1:]
+        for alpha in alpha_list:
+            # The slice of a tuple is still a tuple
+            rhs_list = list(alpha.rhs_list[1:])
             rhs_list.append(new_symbol)
 
             # Add production: A -> bj A'
             Production(pg, new_symbol, rhs_list)
 
         # Add the last A' -> eps
-        Production(pg, new_symbol, [empty_symbol])
+        Production(pg, new_symbol, [EPS])
 
         return True
 
@@ -689,55 +598,16 @@ class NonTerminal(Symbol):
 
         The way we check indirect left recursions is to construct
         a set of all possible left non-terminals in all possible
-        derivations of the LHS of a production. This could be done
-        recursively, but we also adopt memorization to reduce the
-        number of step required from exponential to linear
+        derivations of the LHS of a production, which must have been
+        computed by ParserGenerator.process_first_rhs_set()
 
         :return: bool
         """
-        self.build_first_rhs_set()
+        assert(self.first_rhs_set is not None)
 
         # If the node itself is in the first RHS set then
         # we know there is an indirect left recursion
-        return self in self.first_rhs_set
-
-    def build_first_rhs_set(self):
-        """
-        Builds first RHS set as specified in the definition of the
-        set. We do this recursively using memorization, i.e. the
-        result is saved in self.first_rhs_set and used later
-
-        :return: None
-        """
-        # If we have visited this symbol before then just return
-        # Since the set object is initialized to None on construction
-        # this check guarantees we do not revisit symbols
-        if self.first_rhs_set is not None:
-            return
-        else:
-            # Initialize it to empty set
-            self.first_rhs_set = set()
-
-        # For all productions with this symbol as LHS, recursively
-        # add all first RHS symbol into the set of this symbol
-        for p in self.lhs_set:
-            # The production must have RHS side
-            assert(len(p) != 0)
-            s = p[0]
-            if s.is_terminal() is True:
-                continue
-
-            # Recursively build the set for the first RHS
-            s.build_first_rhs_set()
-
-            # Then merge these two sets
-            self.first_rhs_set = \
-                self.first_rhs_set.union(s.first_rhs_set)
-
-            # Also add the first direct RHS into the set
-            self.first_rhs_set.add(s)
-
-        return
+        return (self.first_rhs_set >> self.id) & 1 == 1
 
     def exists_direct_left_recursion(self):
         """
@@ -754,9 +624,7 @@ class NonTerminal(Symbol):
             # The production must not be an empty one
             # i.e. there must be something on the RHS
             assert(len(p) != 0)
-            # Since we have defined operator== for class Symbol
-            # we could directly compare two symbol
-            if p[0] == self:
+            if p[0] is self:
                 return True
 
         return False
@@ -786,22 +654,44 @@ class NonTerminal(Symbol):
 # member
 Symbol.init_builtin_symbols()
 
+# The empty symbol and the end symbol are used all over the generators
+# and parsers, so they are bound to module level names once
+EPS = Symbol.get_empty_symbol()
+EOF = Symbol.get_end_symbol()
+
 #####################################################################
 # class Production
 #####################################################################
 
-class Production:
+class Production(object):
     """
     This class represents a single production rule that has a left
     hand side non-terminal symbol and
+
+    The LHS and RHS list are only assigned in the constructor and must
+    not be changed afterwards, since the hash code is derived from them
+    and productions are stored in sets
     """
+    __slots__ = ("pg",
+                 "lhs",
+                 "rhs_list",
+                 "rhs_reversed",
+                 "first_set",
+                 "nullable",
+                 "_hash",
+                 "_symbol_positions",
+                 "substring_first_set_list",
+                 "ast_rule",
+                 "rhs_code")
+
     def __init__(self, pg, lhs, rhs_list):
         """
         Initialize the production object
 
         :param pg: The ParserGenerator object
         :param lhs: Left hand side symbol name (string name)
-        :param rhs_list: A list of right hand side symbol names
+        :param rhs_list: A list of right hand side Terminal or NonTerminal
+                         objects, which is stored as a tuple
         """
         # Make sure that the lhs is a non terminal symbol
         assert(lhs.is_non_terminal() is True)
@@ -809,15 +699,21 @@ class Production:
         self.pg = pg
 
         # This is the first set of the production which we use to
-        # select rules for the same LHS
-        self.first_set = set()
-
-        # Since we defined __setattr__() to prevent setting
-        # these two names, we need to set them directly into
-        # the underlying dict object
-        self.__dict__["lhs"] = lhs
-        # We append elements into this list later
-        self.__dict__["rhs_list"] = rhs_list
+        # select rules for the same LHS. It is a mask of terminal IDs
+        self.first_set = 0
+        # Whether the production could derive the empty string. It is
+        # set together with the FIRST set
+        self.nullable = False
+
+        # These two are never assigned again after this point
+        self.lhs = lhs
+        self.rhs_list = tuple(rhs_list)
+        # Parsers push the RHS onto their stacks from right to left
+        self.rhs_reversed = self.rhs_list[::-1]
+        # Since LHS and RHS list could not be changed, the hash code
+        # is computed only once here and before the production is
+        # added into any set
+        self._hash = hash((lhs.name, ) + tuple([s.name for s in rhs_list]))
 
         # Only after this point could we add the production
         # into any set, because the production becomes
@@ -826,27 +722,39 @@ class Production:
 
         # Add a reference to all non-terminal RHS nodes
         for symbol in self.rhs_list:
-            assert(symbol.is_symbol() is True)
             if symbol.is_non_terminal() is True:
                 # We could add self in this way, because
                 # the identify of the set has been fixed
                 symbol.rhs_set.add(self)
 
+        # This maps symbols to the indices they appear in the RHS list,
+        # which is used by get_symbol_index()
+        symbol_positions = {}
+        for index, symbol in enumerate(self.rhs_list):
+            symbol_positions.setdefault(symbol, []).append(index)
+
+        self._symbol_positions = \
+            dict((symbol, tuple(index_list))
+                 for symbol, index_list in symbol_positions.items())
+
         # Also add a reference of this production into the LHS
         # set of the non-terminal
         # Note that since we add it into a set, the identity
         # of the production can no longer be changed
         lhs.lhs_set.add(self)
 
-        # Make sure the user does not input duplicated
-        # productions
-        if self in self.pg.production_set:
+        # Finally add itself into the production set of the
+        # containing pg object. If the set does not grow then the
+        # user has input duplicated productions
+        production_count = len(self.pg.production_set)
+        self.pg.production_set.add(self)
+        if len(self.pg.production_set) == production_count:
             raise KeyError("Production already defined: %s" %
                            (str(self), ))
 
-        # Finally add itself into the production set of the
-        # containing pg object
-        self.pg.production_set.add(self)
+        # Only add it to the list after making sure it is not
+        # a duplicate, since lists do not reject duplicates
+        lhs.lhs_list.append(self)
 
         # This is the table for holding the FIRST set for
         # all prefixes of the production
@@ -858,6 +766,10 @@ class Production:
         # in the syntax definition
         self.ast_rule = None
 
+        # This is the RHS encoded as integers for the LL(1) driver.
+        # See ParserGeneratorLL1.generate_parsing_table()
+        self.rhs_code = None
+
         return
 
     def size(self):
@@ -869,55 +781,84 @@ class Production:
 
         :return: int
         """
-        if self.rhs_list[0] == Symbol.get_empty_symbol():
+        if self.rhs_list[0] is EPS:
             return 0
 
         return len(self.rhs_list)
 
-    def prepare_substring_first(self):
+    def prepare_substring_first(self, mask_pool=None):
         """
         This function prepares all possible substring FIRST
         set in a table for later use.
 
+        Sets in the table are masks of terminal IDs, which could not
+        be modified by callers of compute_substring_first()
+
+        The FIRST set of a suffix only depends on its first symbol and
+        the FIRST set of the suffix after that symbol, so the table is
+        filled from right to left in a single pass. The FIRST set of
+        all symbols must have been computed (see
+        ParserGenerator.process_first_follow())
+
+        :param mask_pool: If not None, a dict from masks to themselves
+                          that is used to share equal mask objects
         :return: None
         """
-        for i in range(0, len(self.rhs_list)):
-            self.substring_first_set_list.append(
-                self._compute_substring_first(i)
-            )
+        empty_mask = EPS.mask
+
+        # The FIRST set of the empty suffix is just the empty symbol
+        s = empty_mask
+        substring_first_set_list = [0] * len(self.rhs_list)
+        for i in range(len(self.rhs_list) - 1, -1, -1):
+            rhs = self.rhs_list[i]
+            if rhs.is_terminal() is True:
+                s = rhs.mask
+            else:
+                # This makes sure that the first set must already been
+                # generated before calling this function
+                assert(rhs.first_set != 0)
+
+                # If the non-terminal could derive empty string then the
+                # FIRST set of the rest is also included, with or
+                # without the empty symbol as it is there
+                if rhs.nullable is True:
+                    s |= rhs.first_set & ~empty_mask
+                else:
+                    s = rhs.first_set & ~empty_mask
+
+            if mask_pool is not None:
+                s = mask_pool.setdefault(s, s)
+
+            substring_first_set_list[i] = s
+
+        self.substring_first_set_list = substring_first_set_list
 
         return
 
     def get_symbol_index(self, symbol):
         """
-        Returns a list of indices a symbol appear in the RHS list
+        Returns a tuple of indices a symbol appear in the RHS list
 
         Note that the symbol could be either terminal or non-terminal
         and we do not check its identify. If the symbol does not
-        exist we return an empty list
+        exist we return an empty tuple
 
-        :return: list(int)
-        """
-        # First of all it must be a symbol
-        assert(symbol.is_symbol() is True)
-
-        ret = []
-        # This tracks the index of the current item
-        index = 0
-        for s in self.rhs_list:
-            if s == symbol:
-                ret.append(index)
+        The indices are computed in the constructor since the RHS
+        list could not be changed
 
-            index += 1
-
-        return ret
+        :param symbol: The Terminal or NonTerminal object
+        :return: tuple(int)
+        """
+        return self._symbol_positions.get(symbol, ())
 
     def compute_substring_first(self, index=0):
         """
         Fast retrieves the substring FIRST set from the production
 
+        The set is computed only once as a mask of terminal IDs
+
         :param index: The beginning index
-        :return: None
+        :return: int
         """
         assert(index < len(self.rhs_list))
 
@@ -928,68 +869,12 @@ class Production:
         Add substring FIRST set into a given set
 
         :param index: The index of the starting point
-        :param s: The set we add symbols to
-        :return: None
+        :param s: The symbol set mask we add symbols to
+        :return: The new symbol set mask
         """
         assert (index < len(self.rhs_list))
 
-        # Add all symbols
-        for symbol in self.substring_first_set_list[index]:
-            s.add(symbol)
-
-        return
-
-    def _compute_substring_first(self, index):
-        """
-        This function computes the FIRST set for a substring. An optional
-        index field is also provided to allow the user to start
-        computing from a certain starting index
-
-        Note that the FIRST set of the entire production has already been
-        computed in compute_first() of a terminal symbol. The algorithm
-        there is very similar to the one used here. Nevertheless, the
-        result of passing index = 0 and the result computed by the
-        non-terminal should be the same
-
-        This function should not be called directly, but rather it is
-        used by the initialization routine to populate the internal
-        FIRST set table
-
-        :return: set(Terminal)
-        """
-        assert(index < len(self.rhs_list))
-
-        ret = set()
-        for i in range(index, len(self.rhs_list)):
-            rhs = self.rhs_list[i]
-
-            # If we have seen a terminal, then add it to the list
-            # and then return
-            if rhs.is_terminal() is True:
-                ret.add(rhs)
-                return ret
-            else:
-                # This makes sure that the first set must already been
-                # generated before calling this function
-                assert(len(rhs.first_set) > 0)
-
-                # Otherwise just union with the non-terminal's
-                # first_set
-                ret = ret.union(rhs.first_set)
-                # Remove potential empty symbol
-                ret.discard(Symbol.get_empty_symbol())
-
-                # If the non-terminal could not derive empty then
-                # that's it
-                if Symbol.get_empty_symbol() not in rhs.first_set:
-                    return ret
-
-        # When we get to here we know that all non-terminals could
-        # derive to empty string, and there is no terminal in the
-        # sequence, so need also to add empty symbol
-        ret.add(Symbol.get_empty_symbol())
-
-        return ret
+        return s | self.substring_first_set_list[index]
 
     def clear(self):
         """
@@ -1001,6 +886,7 @@ class Production:
         # Remove this production from the LHS's LHS set
         # This happens in-place
         self.lhs.lhs_set.remove(self)
+        self.lhs.lhs_list.remove(self)
         for symbol in self.rhs_list:
             # If it is a non-terminal then we remove
             # the production from its rhs set
@@ -1012,27 +898,6 @@ class Production:
 
         return
 
-    def __setattr__(self, key, value):
-        """
-        Controls attribute access of this object because we do not allow
-        accessing LHS and RHS list of this class directly
-
-        Note that unlink getattr(), this is always called on attribute
-        access.
-
-        :param key: The attribute name
-        :param value: The attribute value
-        :return: None
-        """
-        if key == "lhs" or key == "rhs_list":
-            raise KeyError("Cannot set key %s for class Production" %
-                           (key, ))
-
-        # Otherwise directly set the attribute into dict
-        self.__dict__[key] = value
-
-        return
-
     def __getitem__(self, item):
         """
         This mimics the list syntax
@@ -1047,19 +912,16 @@ class Production:
         This function computes the hash for production object.
 
         The hash of a production object is defined by each of its
-        components: lhs and every symbol in RHS list. We combine
-        the hash code of each component using XOR and return
+        components: lhs and every symbol in RHS list. We hash the
+        tuple of their names, such that productions whose RHS are
+        permutations of each other do not collide as they would if
+        hash codes were combined using XOR
+
+        The hash code is computed in the constructor
 
         :return: hash code
         """
-        # This computes the hash of the lhs name
-        h = hash(self.lhs)
-
-        # Then combine the hash by XOR the hash of each RHS symbol
-        for rhs in self.rhs_list:
-            h ^= hash(rhs)
-
-        return h
+        return self._hash
 
     def __eq__(self, other):
         """
@@ -1072,18 +934,25 @@ class Production:
         :param other: The other object
         :return: bool
         """
+        # Equal productions always have the same hash code, and
+        # since it is cached this rejects most productions with
+        # a single integer comparison
+        if self._hash != other._hash:
+            return False
+
         # If the length differs then we know they will never
         # be the same. We do this before any string comparison
         if len(self.rhs_list) != len(other.rhs_list):
             return False
 
-        if self.lhs != other.lhs:
+        if self.lhs is not other.lhs:
             return False
 
         # Use index to fetch component
+        # Symbols are unique for each name so we compare identity
         for rhs1, rhs2 in zip(self.rhs_list, other.rhs_list):
             # If there is none inequality then just return
-            if rhs1.__eq__(rhs2) is False:
+            if rhs1 is not rhs2:
                 return False
 
         return True
@@ -1175,7 +1044,7 @@ class LRItem:
         # because empty string does not conceptually take
         # terminals and therefore could not have two separate
         # states
-        if p.rhs_list[0] == Symbol.get_empty_symbol():
+        if p.rhs_list[0] is EPS:
             assert(index == 0)
             assert(len(p.rhs_list) == 1)
             self.is_empty_production = True
@@ -1414,6 +1283,7 @@ class LR1Item(LRItem):
 
         # We always create a new lookahead set for the new item
         # object to avoid complicated bugs
+        empty_mask = EPS.mask
         if self.index + 1 == len(self.p.rhs_list):
             lookahead_set = self.lookahead_set
         else:
@@ -1421,11 +1291,9 @@ class LR1Item(LRItem):
             # dot symbol
             lookahead_set = \
                 self.p.compute_substring_first(self.index + 1)
-            if Symbol.get_empty_symbol() in lookahead_set:
-                lookahead_set = lookahead_set.copy()
-                lookahead_set.remove(Symbol.get_empty_symbol())
+            if lookahead_set & empty_mask != 0:
                 lookahead_set = \
-                    lookahead_set.union(self.lookahead_set)
+                    (lookahead_set & ~empty_mask) | self.lookahead_set
 
         # Then add every production into the set and return
         for p in symbol.lhs_set:
@@ -1465,7 +1333,10 @@ class LR1Item(LRItem):
 
         :return: str
         """
-        return "[%s, %d, %s]" % (self.p, self.index, self.lookahead_set)
+        return "[%s, %d, %s]" % \
+               (self.p,
+                self.index,
+                Symbol.expand_symbol_set(self.lookahead_set))
 
     def __str__(self):
         """
@@ -1541,8 +1412,7 @@ class ItemSet:
                 # If they have the same production and the same
                 # position then just merge them into the dest_item
                 if src_item == dest_item:
-                    i.lookahead_set = \
-                        i.lookahead_set.union(j.lookahead_set)
+                    i.lookahead_set |= j.lookahead_set
                     break
 
         return
@@ -1610,7 +1480,7 @@ class ItemSet:
                     continue
 
                 # If this item could be used to GOTO
-                if dotted_symbol == symbol:
+                if dotted_symbol is symbol:
                     # Then move the dot to the next position
                     # which is guaranteed to be valid
                     # Note that here we could not hard code the
@@ -1645,9 +1515,7 @@ class ItemSet:
                     value = core_item_dict[key]
                     # We never modify it in-place, so just fork a
                     # new instance
-                    value.lookahead_set = \
-                        value.lookahead_set.union(
-                            item.lookahead_set)
+                    value.lookahead_set |= item.lookahead_set
 
             # If we did merged items them we need to change
             # the item set because the hash value has changed
@@ -1760,7 +1628,8 @@ class ParserGenerator:
         self.file_name = file_name
 
         # This is a mapping from symbol name to either terminals
-        # or non-terminals
+        # or non-terminals. Symbols read from the grammar are created
+        # through intern_symbol() which uses this as the pool
         self.symbol_dict = {}
 
         # This is a set of terminal objects
@@ -1885,68 +1754,389 @@ class ParserGenerator:
         that the FIRST set of S for ruleS -> S does not affect S
         at all
 
+        Productions are flattened into lists indexed by the position
+        of non-terminals and productions in the lists below, and the
+        fixpoint is computed on these lists rather than by recursively
+        visiting symbol objects
+
         :return: None
         """
+        empty_mask = EPS.mask
+
         # We use this to fix the order of iteration
         nt_list = list(self.non_terminal_set)
+        p_list = list(self.production_set)
+        nt_index_dict = dict((nt, index) for index, nt in enumerate(nt_list))
+
+        # For production i, its LHS is non-terminal lhs_index_list[i],
+        # and its RHS is from rhs_offset_list[i] (inclusive) to
+        # rhs_offset_list[i + 1] (exclusive) in the following two lists.
+        # For terminals the index is -1 and the mask is its bit; For
+        # non-terminals the mask is 0
+        lhs_index_list = []
+        rhs_offset_list = [0]
+        rhs_index_list = []
+        rhs_mask_list = []
+        for p in p_list:
+            lhs_index_list.append(nt_index_dict[p.lhs])
+            for symbol in p.rhs_list:
+                if symbol.is_terminal() is True:
+                    rhs_index_list.append(-1)
+                    rhs_mask_list.append(symbol.mask)
+                else:
+                    rhs_index_list.append(nt_index_dict[symbol])
+                    rhs_mask_list.append(0)
 
-        dbg_printf("Compute FIRST set")
+            rhs_offset_list.append(len(rhs_index_list))
 
-        # A list of FIRST set sizes; we iterate until this
-        # becomes stable
-        count_list = [nt.get_first_length() for nt in nt_list]
-        index = 0
-        while True:
-            index += 1
-            dbg_printf("    Iteration %d", index)
+        dbg_printf("Compute FIRST set")
 
-            for symbol in self.non_terminal_set:
-                symbol.clear_result_available()
+        nt_first_list, p_first_list = \
+            ParserGenerator._fixpoint_first(len(nt_list),
+                                            lhs_index_list,
+                                            rhs_offset_list,
+                                            rhs_index_list,
+                                            rhs_mask_list,
+                                            empty_mask)
 
-            for symbol in self.non_terminal_set:
-                symbol.compute_first([])
+        # Masks wider than a machine word are separate long objects
+        # even if they are equal, and in a real grammar most FIRST and
+        # FOLLOW sets repeat, so we keep one object per distinct mask
+        mask_pool = {}
 
-            # This is the vector after iteration
-            t = [nt.get_first_length() for nt in nt_list]
-            if t == count_list:
-                break
+        for nt, first_set in zip(nt_list, nt_first_list):
+            nt.first_set = mask_pool.setdefault(first_set, first_set)
+            nt.nullable = first_set & empty_mask != 0
 
-            count_list = t
+        for p, first_set in zip(p_list, p_first_list):
+            p.first_set = mask_pool.setdefault(first_set, first_set)
+            p.nullable = first_set & empty_mask != 0
 
         # After computing the FIRST set for symbols now
         # we prepare the substring FIRST set for all
         # productions
         dbg_printf("Compute suffix FIRST set for productions")
         for p in self.production_set:
-            p.prepare_substring_first()
+            p.prepare_substring_first(mask_pool)
 
         dbg_printf("Compute FOLLOW set")
 
+        follow_list = [0] * len(nt_list)
+
         # First add EOF symbol into the root symbol
-        # We need to do this before the algorithm converges
         assert (self.root_symbol is not None)
-        self.root_symbol.follow_set.add(Symbol.get_end_symbol())
+        follow_list[nt_index_dict[self.root_symbol]] |= \
+            EOF.mask
+
+        # For every non-terminal in the RHS, the FIRST set of the
+        # substring after it is added to its FOLLOW set. If the
+        # substring could be empty (or there is no substring) then
+        # FOLLOW(LHS) is also added, which we record as an edge
+        # from LHS to the non-terminal
+        edge_src_list = []
+        edge_dst_list = []
+        for p_index, p in enumerate(p_list):
+            lhs_index = lhs_index_list[p_index]
+            start = rhs_offset_list[p_index]
+            end = rhs_offset_list[p_index + 1]
+            for i in range(start, end):
+                nt_index = rhs_index_list[i]
+                if nt_index < 0:
+                    continue
 
-        count_list = [nt.get_follow_length() for nt in nt_list]
-        index = 0
-        while True:
-            index += 1
-            dbg_printf("    Iteration %d", index)
+                if i + 1 == end:
+                    substr_first_set = empty_mask
+                else:
+                    substr_first_set = \
+                        p.compute_substring_first(i + 1 - start)
+
+                follow_list[nt_index] |= substr_first_set & ~empty_mask
+                if substr_first_set & empty_mask != 0 and \
+                   nt_index != lhs_index:
+                    edge_src_list.append(lhs_index)
+                    edge_dst_list.append(nt_index)
+
+        ParserGenerator._fixpoint_follow(follow_list,
+                                         edge_src_list,
+                                         edge_dst_list)
+
+        for nt, follow_set in zip(nt_list, follow_list):
+            nt.follow_set = mask_pool.setdefault(follow_set, follow_set)
+
+        return
+
+    @staticmethod
+    def _fixpoint_first(nt_count,
+                        lhs_index_list,
+                        rhs_offset_list,
+                        rhs_index_list,
+                        rhs_mask_list,
+                        empty_mask):
+        """
+        Computes FIRST sets of non-terminals and productions using
+        the flattened productions (see process_first_follow())
+
+        FIRST(A) depends on FIRST(B) if B appears before the first
+        terminal in a production of A. We find strongly connected
+        components of this dependency graph and process them such
+        that the components a component depends on are always
+        processed before it. Productions of a component are iterated
+        until no set changes, which takes only one pass if the
+        component is not recursive
+
+        :return: (list(int), list(int)), FIRST sets of non-terminals
+                 and productions
+        """
+        not_empty_mask = ~empty_mask
+        nt_first_list = [0] * nt_count
+        p_first_list = [0] * len(lhs_index_list)
+
+        # Productions of each non-terminal and the dependency graph
+        lhs_p_list = [[] for _ in range(nt_count)]
+        succ_list = [[] for _ in range(nt_count)]
+        for p_index, lhs_index in enumerate(lhs_index_list):
+            lhs_p_list[lhs_index].append(p_index)
+            for i in range(rhs_offset_list[p_index],
+                           rhs_offset_list[p_index + 1]):
+                nt_index = rhs_index_list[i]
+                if nt_index < 0:
+                    break
+
+                succ_list[lhs_index].append(nt_index)
+
+        for component in \
+                ParserGenerator._find_scc(nt_count, succ_list):
+            p_index_list = []
+            for nt_index in component:
+                p_index_list.extend(lhs_p_list[nt_index])
+
+            is_recursive = len(component) > 1 or \
+                           component[0] in succ_list[component[0]]
+
+            changed = True
+            while changed is True:
+                changed = False
+                for p_index in p_index_list:
+                    first_set = 0
+                    for i in range(rhs_offset_list[p_index],
+                                   rhs_offset_list[p_index + 1]):
+                        nt_index = rhs_index_list[i]
+                        # For terminals just add it and stop. Empty
+                        # symbol is also added here if it is derived
+                        if nt_index < 0:
+                            first_set |= rhs_mask_list[i]
+                            break
+
+                        rhs_first_set = nt_first_list[nt_index]
+                        first_set |= rhs_first_set & not_empty_mask
+                        # If the empty symbol could not be derived then
+                        # we do not check the following non-terminals
+                        if rhs_first_set & empty_mask == 0:
+                            break
+                    else:
+                        # All symbols are non-terminals and they could
+                        # all derive empty string
+                        first_set |= empty_mask
+
+                    if first_set != p_first_list[p_index]:
+                        # Sets only grow during the iteration
+                        p_first_list[p_index] = first_set
+                        nt_first_list[lhs_index_list[p_index]] |= first_set
+                        changed = True
+
+                # Sets of other components do not change any more,
+                # so one pass is enough without recursion
+                if is_recursive is False:
+                    break
+
+        return nt_first_list, p_first_list
+
+    @staticmethod
+    def _find_scc(node_count, succ_list):
+        """
+        Finds strongly connected components of a directed graph using
+        Tarjan's algorithm. The recursion of the algorithm is emulated
+        using a stack, such that deep graphs do not exceed the limit
+        of recursion
+
+        Components are returned such that a component is always after
+        all components that are reachable from it
+
+        :param node_count: The number of nodes which are 0 to
+                           node_count - 1
+        :param succ_list: The list of successors of each node
+        :return: list(list(int))
+        """
+        index_list = [-1] * node_count
+        low_list = [0] * node_count
+        on_stack_list = [False] * node_count
+        # Nodes that are not yet assigned a component
+        node_stack = []
+        ret = []
+        next_index = 0
+
+        for root in range(node_count):
+            if index_list[root] != -1:
+                continue
+
+            index_list[root] = low_list[root] = next_index
+            next_index += 1
+            node_stack.append(root)
+            on_stack_list[root] = True
+
+            # Each frame is the node and the position of the next
+            # successor to visit
+            frame_list = [[root, 0]]
+            while len(frame_list) != 0:
+                frame = frame_list[-1]
+                node = frame[0]
+                node_succ_list = succ_list[node]
+
+                if frame[1] < len(node_succ_list):
+                    succ = node_succ_list[frame[1]]
+                    frame[1] += 1
+
+                    if index_list[succ] == -1:
+                        index_list[succ] = low_list[succ] = next_index
+                        next_index += 1
+                        node_stack.append(succ)
+                        on_stack_list[succ] = True
+                        frame_list.append([succ, 0])
+                    elif on_stack_list[succ] is True and \
+                         index_list[succ] < low_list[node]:
+                        low_list[node] = index_list[succ]
+
+                    continue
+
+                # All successors have been visited
+                frame_list.pop()
+                if len(frame_list) != 0:
+                    parent = frame_list[-1][0]
+                    if low_list[node] < low_list[parent]:
+                        low_list[parent] = low_list[node]
+
+                # If this is the root of a component then pop all
+                # nodes of the component
+                if low_list[node] == index_list[node]:
+                    component = []
+                    while True:
+                        member = node_stack.pop()
+                        on_stack_list[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+
+                    ret.append(component)
+
+        return ret
+
+    def assign_non_terminal_id(self):
+        """
+        Numbers all non-terminals from 0 (see NonTerminal.id). This
+        should be called again after non-terminals are added
+
+        :return: list(NonTerminal), the non-terminals indexed by ID
+        """
+        nt_list = list(self.non_terminal_set)
+        for index, nt in enumerate(nt_list):
+            nt.id = index
+
+        return nt_list
+
+    def process_first_rhs_set(self):
+        """
+        Computes the first RHS set (see NonTerminal.first_rhs_set) for
+        all non-terminals at once
+
+        Non-terminals are the nodes of a graph in which A has an edge
+        to B if B is the first symbol of a production of A. The first
+        RHS set of A is all nodes reachable from A, and it is the same
+        for all non-terminals in a strongly connected component. Since
+        components are found in an order that a component comes after
+        all components reachable from it, each of them is visited once
+
+        :return: None
+        """
+        nt_list = self.assign_non_terminal_id()
+
+        succ_list = []
+        for nt in nt_list:
+            index_set = set()
+            for p in nt.lhs_set:
+                # The production must have RHS side
+                assert(len(p) != 0)
+                if p[0].is_non_terminal() is True:
+                    index_set.add(p[0].id)
+
+            succ_list.append(list(index_set))
+
+        first_rhs_list = [0] * len(nt_list)
+        for component in \
+                ParserGenerator._find_scc(len(nt_list), succ_list):
+            # Every member of a component with more than one node is
+            # the target of an edge inside the component, so the bits
+            # of members are added by the loop below
+            first_rhs_set = 0
+            for index in component:
+                for succ in succ_list[index]:
+                    first_rhs_set |= (1 << succ) | first_rhs_list[succ]
+
+            for index in component:
+                first_rhs_list[index] = first_rhs_set
+
+        for nt, first_rhs_set in zip(nt_list, first_rhs_list):
+            nt.first_rhs_set = first_rhs_set
+
+        return
 
-            for symbol in self.non_terminal_set:
-                symbol.clear_result_available()
+    @staticmethod
+    def _fixpoint_follow(follow_list, edge_src_list, edge_dst_list):
+        """
+        Adds FOLLOW sets along edges from source to destination
+        non-terminals until no set changes
 
-            for symbol in self.non_terminal_set:
-                # The path list must be empty list
-                # because we start from a fresh new state
-                # for every iteration
-                symbol.compute_follow([])
+        This uses a work list of non-terminals whose sets have not
+        been propagated to their successors yet. A non-terminal is
+        only added back into the list if its set grows, so each edge
+        is visited once per change of the source set rather than
+        once per pass over all edges
 
-            t = [nt.get_follow_length() for nt in nt_list]
-            if t == count_list:
-                break
+        :param follow_list: FOLLOW sets indexed by non-terminals,
+                            which are updated in-place
+        :param edge_src_list: The source of edges
+        :param edge_dst_list: The destination of edges
+        :return: None
+        """
+        nt_count = len(follow_list)
+        succ_list = [[] for _ in range(nt_count)]
+        for src, dst in zip(edge_src_list, edge_dst_list):
+            succ_list[src].append(dst)
+
+        # Initially all non-terminals with both a non-empty set and
+        # successors need to be propagated
+        in_work_list = [False] * nt_count
+        work_list = collections.deque()
+        for nt_index in range(nt_count):
+            if follow_list[nt_index] != 0 and \
+               len(succ_list[nt_index]) != 0:
+                in_work_list[nt_index] = True
+                work_list.append(nt_index)
+
+        while len(work_list) != 0:
+            src = work_list.popleft()
+            in_work_list[src] = False
+
+            src_follow_set = follow_list[src]
+            for dst in succ_list[src]:
+                follow_set = follow_list[dst] | src_follow_set
+                if follow_set == follow_list[dst]:
+                    continue
 
-            count_list = t
+                follow_list[dst] = follow_set
+                if in_work_list[dst] is False and \
+                   len(succ_list[dst]) != 0:
+                    in_work_list[dst] = True
+                    work_list.append(dst)
 
         return
 
@@ -2263,6 +2453,34 @@ class ParserGenerator:
 
         return
 
+    def intern_symbol(self, name, is_terminal):
+        """
+        Returns the symbol object of the given name, which is created
+        and added into the terminal or non-terminal set if it has not
+        been seen before, such that each name maps to exactly one
+        object in this generator
+
+        :param name: The name of the symbol
+        :param is_terminal: Whether the symbol is a terminal
+        :return: Symbol
+        """
+        symbol = self.symbol_dict.get(name, None)
+        if symbol is not None:
+            # The same name could not be used for both kinds
+            assert(symbol.is_terminal() is is_terminal)
+            return symbol
+
+        if is_terminal is True:
+            symbol = Terminal.intern(name)
+            self.terminal_set.add(symbol)
+        else:
+            symbol = NonTerminal(name)
+            self.non_terminal_set.add(symbol)
+
+        self.symbol_dict[name] = symbol
+
+        return symbol
+
     def process_symbol(self, line_list):
         """
         Recognize symbols, and store them into the dictionary for
@@ -2271,9 +2489,10 @@ class ParserGenerator:
         :param line_list: A list of lines
         :return: None
         """
-        # This is a set of names for which we are not certain whether
-        # it is a terminal or non-terminal
-        in_doubt_set = set()
+        # Names on the LHS in the order they are defined, and all
+        # names that appear on the RHS
+        lhs_name_list = []
+        rhs_name_set = set()
 
         for line in line_list:
             # If there are semantic rules just disregard it here
@@ -2285,53 +2504,25 @@ class ParserGenerator:
             # Also non-terminal is very easy to identify because
             # it must be on the LHS side at least once
             if line[-1] == ':':
-                # This is the name of the terminal
-                name = line[:-1]
-                # Create the non-terminal object and then
-                non_terminal = NonTerminal(name)
-
-                # If the non-terminal object already exists then we have
-                # seen duplicated definition
-                if non_terminal in self.symbol_dict:
-                    raise KeyError("Duplication definition of non-terminal: %s" %
-                                   (name, ))
-
-                # Add the non-terminal node into both symbol dictionary
-                # and the non-terminal set
-                self.symbol_dict[name] = non_terminal
-                self.non_terminal_set.add(non_terminal)
-
-                # Since we already know that name is a non-terminal
-                # we could remove it from this set
-                # discard() does not raise error even if the name
-                # is not in the set
-                in_doubt_set.discard(name)
+                lhs_name_list.append(line[:-1])
             else:
-                # Split the line using space characters
-                name_list = line.split()
-                # We do not know whether name is a terminal or non-terminal
-                # but we could rule out those that are known to be
-                # non-terminals
-                for name in name_list:
-                    # If the name is already seen and it is a terminal
-                    # then we skip it
-                    if name in self.symbol_dict:
-                        continue
+                rhs_name_set.update(line.split())
 
-                    # Add the name into in_doubt_set because
-                    # we are unsure about its status
-                    in_doubt_set.add(name)
+        # Create the non-terminal objects, which are also added
+        # into both symbol dictionary and the non-terminal set. A name
+        # that is already in the dictionary has been defined before
+        for name in lhs_name_list:
+            if name in self.symbol_dict:
+                raise KeyError("Duplication definition of non-terminal: %s" %
+                               (name, ))
 
-        # After this loop, in_doubt_set contains names that do not
-        # appear as the left hand side, and must be terminals
-        for name in in_doubt_set:
-            assert(name not in self.symbol_dict)
-            terminal = Terminal(name)
-            self.symbol_dict[name] = terminal
+            self.intern_symbol(name, False)
 
-            # And then add terminals into the terminal set
-            assert(terminal not in self.terminal_set)
-            self.terminal_set.add(terminal)
+        # Names that do not appear as the left hand side must be
+        # terminals
+        for name in rhs_name_set.difference(lhs_name_list):
+            assert(name not in self.symbol_dict)
+            self.intern_symbol(name, True)
 
         return
 
@@ -2348,26 +2539,42 @@ class ParserGenerator:
         :param ss: The set instance
         :return: None
         """
-        first = True
-        fp.write("{")
+        fp.write(ParserGenerator.format_symbol_set(ss))
+
+        return
+
+    @staticmethod
+    def format_symbol_set(ss):
+        """
+        Returns the string that dump_symbol_set() writes for a set
 
+        :param ss: The set instance
+        :return: str
+        """
         # Make each iteration produce uniform result
         ss = list(ss)
         ss.sort()
 
-        for i in ss:
-            # Must be a symbol element
-            assert (i.is_symbol() is True)
-            if first is False:
-                fp.write(", ")
-            else:
-                first = False
+        return "{" + ", ".join([i.name for i in ss]) + "}"
 
-            fp.write(i.name)
+    @staticmethod
+    def format_symbol_mask(mask, str_dict):
+        """
+        Returns the string of a symbol set mask as format_symbol_set()
+        does. Strings are remembered in the given dict, since equal
+        sets are very common among symbols and productions
 
-        fp.write("}")
+        :param mask: The symbol set mask
+        :param str_dict: A dict from masks to strings
+        :return: str
+        """
+        s = str_dict.get(mask, None)
+        if s is None:
+            s = ParserGenerator.format_symbol_set(
+                Symbol.expand_symbol_set(mask))
+            str_dict[mask] = s
 
-        return
+        return s
 
     def dump_terminal_enum(self, file_name):
         """
@@ -2377,16 +2584,13 @@ class ParserGenerator:
           enum definition into
         :return: None
         """
-        fp = open(file_name, "w")
-        fp.write("enum class TerminalToken {\n")
         symbol_list = [symbol.name for symbol in self.terminal_set]
         symbol_list.sort()
 
-        for name in symbol_list:
-            fp.write("  %s,\n" % (name, ))
-
-        fp.write("};\n")
-
+        fp = open(file_name, "w")
+        fp.write("enum class TerminalToken {\n" +
+                 "".join(["  %s,\n" % (name, ) for name in symbol_list]) +
+                 "};\n")
         fp.close()
 
         return
@@ -2411,12 +2615,20 @@ class ParserGeneratorLR(ParserGenerator):
     LR_TYPE_LR1 = 1
     LR_TYPE_LALR = 2
 
-    def __init__(self, file_name, lr_type=LR_TYPE_SLR):
+    # Bump this whenever the layout of the parsing table changes such
+    # that stale cache files are no longer usable
+    CACHE_VERSION = 1
+
+    def __init__(self, file_name, lr_type=LR_TYPE_SLR, cache_file_name=None):
         """
         Read syntax file into the class and analyze its symbols and
         productions
 
         :param file_name: The file name of the syntax file
+        :param lr_type: One of the LR_TYPE_ constants
+        :param cache_file_name: If not None, the parsing table is loaded
+                                from this file when the syntax file has
+                                not changed, and saved into it otherwise
         """
         # read file is called inside the constructor
         ParserGenerator.__init__(self, file_name)
@@ -2464,7 +2676,7 @@ class ParserGeneratorLR(ParserGenerator):
 
         # Also add end symbol T_EOF (i.e. $ symbol) into the
         # terminal set. This will appear in the FOLLOW set
-        self.terminal_set.add(Symbol.get_end_symbol())
+        self.terminal_set.add(EOF)
 
         # Use the fake root symbol to derive root symbol
         # because we need it to be the sign of termination
@@ -2483,6 +2695,15 @@ class ParserGeneratorLR(ParserGenerator):
         # compute the FOLLOW set before everything else
         self.process_first_follow()
 
+        # The item sets are the expensive part; if the syntax file is
+        # the same as the one the cached table was built from then
+        # we do not need them at all
+        cache_key = None
+        if cache_file_name is not None:
+            cache_key = self.get_cache_key(file_name)
+            if self.load_cache(cache_file_name, cache_key) is True:
+                return
+
         # This function generates the canonical LR set
         self.process_item_set()
 
@@ -2496,6 +2717,82 @@ class ParserGeneratorLR(ParserGenerator):
         # if there is any conflict
         self.generate_parsing_table()
 
+        if cache_key is not None:
+            self.save_cache(cache_file_name, cache_key)
+
+        return
+
+    def get_cache_key(self, file_name):
+        """
+        Returns the key that identifies a parsing table built from the
+        given syntax file with the current LR type. It is the SHA-256 of
+        the file contents, so touching the file does not invalidate the
+        cache but any change to the grammar does
+
+        :param file_name: The file name of the syntax file
+        :return: str
+        """
+        fp = open(file_name, "rb")
+        digest = hashlib.sha256(fp.read()).hexdigest()
+        fp.close()
+
+        return "%s:%d:%d" % (digest, self.lr_type, self.CACHE_VERSION)
+
+    def load_cache(self, file_name, cache_key):
+        """
+        Loads the starting state and the parsing table from a cache file
+        written by save_cache(). Missing, unreadable or stale cache files
+        are ignored
+
+        :param file_name: The cache file
+        :param cache_key: The key returned by get_cache_key()
+        :return: True if the table is loaded; False otherwise
+        """
+        try:
+            fp = open(file_name, "rb")
+        except IOError:
+            return False
+
+        try:
+            try:
+                key, starting_state, parsing_table = pickle.load(fp)
+            except Exception:
+                dbg_printf("Ignoring unreadable cache file: %s", file_name)
+                return False
+        finally:
+            fp.close()
+
+        if key != cache_key:
+            dbg_printf("Cache file %s is stale", file_name)
+            return False
+
+        self.starting_state = starting_state
+        self.parsing_table = parsing_table
+
+        dbg_printf("Loaded %d entries from cache file: %s",
+                   len(self.parsing_table),
+                   file_name)
+
+        return True
+
+    def save_cache(self, file_name, cache_key):
+        """
+        Saves the starting state and the parsing table into a cache file
+        such that the next run on the same syntax file could skip
+        building item sets
+
+        :param file_name: The cache file
+        :param cache_key: The key returned by get_cache_key()
+        :return: None
+        """
+        dbg_printf("Saving parsing table into cache file: %s", file_name)
+
+        fp = open(file_name, "wb")
+        pickle.dump((cache_key, self.starting_state, self.parsing_table),
+                    fp,
+                    pickle.HIGHEST_PROTOCOL)
+        fp.close()
+
         return
 
     def merge_item_set(self):
@@ -2700,15 +2997,15 @@ class ParserGeneratorLR(ParserGenerator):
         """
         dbg_printf("Dumping parsing table into file: %s", file_name)
 
-        fp = open(file_name, "w")
-
-        # Write the starting state first
-        fp.write("%d\n" % (self.starting_state, ))
-
-        # For each key value pair dump them into the file
+        # Write the starting state first, and then each key value
+        # pair. The lines are joined and written at once
+        line_list = ["%d\n" % (self.starting_state, )]
         for key, value in self.parsing_table.items():
-            fp.write("%s -> %s\n" % (json.dumps(key), json.dumps(value)))
+            line_list.append("%s -> %s\n" %
+                             (json.dumps(key), json.dumps(value)))
 
+        fp = open(file_name, "w")
+        fp.write("".join(line_list))
         fp.close()
 
         return
@@ -2785,11 +3082,11 @@ class ParserGeneratorLR(ParserGenerator):
                 # If the LHS is fake root then we know if we see an
                 # EOF we could finish parsing; However if it is not EOF
                 # then parsing may continue
-                if lhs == self.fake_production.lhs:
+                if lhs is self.fake_production.lhs:
                     dbg_printf("Setting finish state for fake root symbol")
 
                     # Note that we use the name of T_EOF as the key here
-                    k = (item_set.index, Symbol.get_end_symbol().name)
+                    k = (item_set.index, EOF.name)
                     assert(k not in self.parsing_table)
 
                     self.parsing_table[k] = (self.ACTION_ACCEPT, )
@@ -2807,7 +3104,7 @@ class ParserGeneratorLR(ParserGenerator):
 
                 # The look-ahead symbol is the follow set of the
                 # LHS symbol of the item
-                for symbol in lookahead_set:
+                for symbol in Symbol.expand_symbol_set(lookahead_set):
                     assert(symbol.is_terminal() is True)
 
                     # Key and value in the mapping table
@@ -2843,7 +3140,9 @@ class ParserGeneratorLR(ParserGenerator):
                             ParserGeneratorLR.print_item_set(item_set, 4)
 
                             dbg_printf("Reduce: %s", item)
-                            dbg_printf("    FOLLOW: %s", item.p.lhs.follow_set)
+                            dbg_printf("    FOLLOW: %s",
+                                       Symbol.expand_symbol_set(
+                                           item.p.lhs.follow_set))
 
                             # In favor of shift
                             continue
@@ -2879,7 +3178,7 @@ class ParserGeneratorLR(ParserGenerator):
             dbg_printf("Compute canonical LR set")
             new_item = LR1Item(self.fake_production,
                                0,
-                               set([Symbol.get_end_symbol()]))
+                               EOF.mask)
         else:
             raise TypeError("Unknown LR parser type: %d" %
                             (self.lr_type, ))
@@ -2987,10 +3286,15 @@ class ParserGeneratorLL1(ParserGenerator):
         """
         ParserGenerator.__init__(self, file_name)
 
-        # It is a directory structure using (NonTerminal, Terminal)
-        # pair as keys, and production rule object as value (note
-        # that we only allow one production per key)
-        self.parsing_table = {}
+        # This is a flat table of production rule objects with a row
+        # for each non-terminal and a column for each terminal, i.e.
+        # entry (A, a) is at A.id * terminal_count + a.id. Entries
+        # without a production are None. Use get_production() to
+        # look up an entry
+        self.parsing_table = []
+        self.terminal_count = 0
+        # Non-terminals indexed by their IDs, i.e. rows of the table
+        self.non_terminal_list = []
 
         # As suggested by name
         self.process_left_recursion()
@@ -3019,20 +3323,39 @@ class ParserGeneratorLL1(ParserGenerator):
 
         :return: None
         """
+        # Bind it once rather than looking it up for every production
+        empty_mask = EPS.mask
+
+        # Terminal IDs are shared by all grammars, so the row covers
+        # all terminals that have been created so far
+        self.non_terminal_list = self.assign_non_terminal_id()
+        self.terminal_count = len(Terminal.TERMINAL_LIST)
+        # Rows are built as dicts from terminal IDs to productions
+        # and then copied into the table
+        row_dict_list = [{} for _ in self.non_terminal_list]
+
+        terminal_list = Terminal.TERMINAL_LIST
         for p in self.production_set:
-            lhs = p.lhs
-            for i in p.first_set:
-                # Do not add empty symbol
-                if i == Symbol.get_empty_symbol():
-                    continue
+            # For parse_terminal_list() the RHS is pushed onto the stack
+            # in reverse order, with terminals as their IDs and
+            # non-terminals as ~ID which is always negative. The empty
+            # symbol matches nothing and is left out
+            p.rhs_code = tuple([~symbol.id
+                                if symbol.is_non_terminal() is True
+                                else symbol.id
+                                for symbol in p.rhs_reversed
+                                if symbol is not EPS])
 
-                pair = (lhs, i)
-                if pair in self.parsing_table:
+            lhs = p.lhs
+            row_dict = row_dict_list[lhs.id]
+            # Do not add empty symbol
+            for i in Symbol.expand_symbol_id(p.first_set & ~empty_mask):
+                if i in row_dict:
                     raise KeyError(
                         "Duplicated (A, FIRST) entry for %s" %
-                        (str(pair), ))
+                        (str((lhs, terminal_list[i])), ))
 
-                self.parsing_table[pair] = p
+                row_dict[i] = p
 
             # If the production produces empty string
             # then we also need to add everything in FOLLOW(lhs)
@@ -3040,18 +3363,92 @@ class ParserGeneratorLL1(ParserGenerator):
             # Since we already verified that no FIRST in other
             # productions could overlap with LHS's FOLLOW set
             # this is entirely safe
-            if Symbol.get_empty_symbol() in p.first_set:
-                for i in lhs.follow_set:
-                    pair = (lhs, i)
-                    if pair in self.parsing_table:
+            if p.nullable is True:
+                for i in Symbol.expand_symbol_id(lhs.follow_set):
+                    if i in row_dict:
                         raise KeyError(
                             "Duplicated (A, FOLLOW) entry for %s" %
-                            (str(pair), ))
+                            (str((lhs, terminal_list[i])), ))
+
+                    row_dict[i] = p
 
-                    self.parsing_table[pair] = p
+        self.parsing_table = \
+            [None] * (len(self.non_terminal_list) * self.terminal_count)
+        for nt_id, row_dict in enumerate(row_dict_list):
+            row = nt_id * self.terminal_count
+            for i, p in row_dict.items():
+                self.parsing_table[row + i] = p
 
         return
 
+    def get_production(self, nt, t):
+        """
+        Returns the production in the parsing table for a non-terminal
+        and a terminal
+
+        :param nt: The NonTerminal object
+        :param t: The Terminal object
+        :return: Production, or None if there is no entry
+        """
+        # Terminals created after the table was generated are not
+        # in the grammar
+        if t.id >= self.terminal_count:
+            return None
+
+        return self.parsing_table[nt.id * self.terminal_count + t.id]
+
+    def parse_terminal_list(self, terminal_list, root_symbol):
+        """
+        Parses a list of terminals starting from the given non-terminal
+        using the parsing table
+
+        The stack holds integers rather than symbol objects (see
+        Production.rhs_code), such that each step is an integer
+        comparison or a list index without any hashing
+
+        :param terminal_list: The list of Terminal objects, which
+                              should end with EOF
+        :param root_symbol: The NonTerminal object to start with
+        :return: int, the number of terminals consumed
+        """
+        parsing_table = self.parsing_table
+        terminal_count = self.terminal_count
+        # If the input runs out before the stack is empty we read this
+        # ID, which is neither a terminal on the stack nor a column of
+        # the table, so the input is rejected without a bounds check
+        terminal_id_list = [t.id for t in terminal_list]
+        terminal_id_list.append(terminal_count)
+
+        index = 0
+        stack = [~root_symbol.id]
+        while len(stack) != 0:
+            top = stack.pop()
+            terminal_id = terminal_id_list[index]
+
+            # Terminals must match the input
+            if top >= 0:
+                if top != terminal_id:
+                    if index == len(terminal_list):
+                        raise ValueError("Unexpected end of input @ %d" %
+                                         (index, ))
+
+                    raise ValueError("Could not match token: %s @ %d" %
+                                     (str(terminal_list[index]), index))
+
+                index += 1
+                continue
+
+            p = None
+            if terminal_id < terminal_count:
+                p = parsing_table[~top * terminal_count + terminal_id]
+
+            if p is None:
+                raise ValueError("Could not find entry in parsing table")
+
+            stack.extend(p.rhs_code)
+
+        return index
+
     def dump(self, file_name):
         """
         This file dumps the contents of the parser generator into a file
@@ -3066,7 +3463,9 @@ class ParserGeneratorLL1(ParserGenerator):
         """
         dbg_printf("Dumping modified syntax to %s", file_name)
 
-        fp = open(file_name, "w")
+        # The file is built as a list of lines and written at once
+        line_list = []
+        str_dict = {}
 
         # Construct a list and sort them in alphabetical order
         # Since we have already defined the less than function for
@@ -3075,28 +3474,27 @@ class ParserGeneratorLL1(ParserGenerator):
         nt_list.sort()
         # We preserve these symbols
         for symbol in nt_list:
-            fp.write("%s: " % (symbol.name, ))
-
-            ParserGenerator.dump_symbol_set(fp, symbol.first_set)
-            fp.write(" ")
-            ParserGenerator.dump_symbol_set(fp, symbol.follow_set)
-
-            # End the non-terminal line
-            fp.write("\n")
+            line_list.append(
+                "%s: %s %s\n" %
+                (symbol.name,
+                 ParserGenerator.format_symbol_mask(symbol.first_set,
+                                                    str_dict),
+                 ParserGenerator.format_symbol_mask(symbol.follow_set,
+                                                    str_dict)))
 
             for p in symbol.lhs_set:
-                fp.write("   ")
-                for rhs in p.rhs_list:
-                    fp.write(" %s" % (rhs.name, ))
-
-                fp.write("; ")
-                ParserGenerator.dump_symbol_set(fp, p.first_set)
+                line_list.append(
+                    "    %s; %s\n" %
+                    (" ".join([rhs.name for rhs in p.rhs_list]),
+                     ParserGenerator.format_symbol_mask(p.first_set,
+                                                        str_dict)))
 
-                fp.write("\n")
-
-            fp.write("\n")
+            line_list.append("\n")
 
+        fp = open(file_name, "w")
+        fp.write("".join(line_list))
         fp.close()
+
         return
 
     def dump_parsing_table(self, file_name):
@@ -3115,26 +3513,27 @@ class ParserGeneratorLL1(ParserGenerator):
         """
         dbg_printf("Dumping parsing table into %s", file_name)
 
-        fp = open(file_name, "w")
-
-        # Sort the list of keys such that NonTerminals group together
-        # and then terminals group together
-        key_list = self.parsing_table.keys()
-        key_list.sort()
-
-        prev_key = None
-        for k in key_list:
-            # If the key changes we also print a new line
-            if prev_key is None:
-                prev_key = k[0]
-            elif prev_key != k[0]:
-                fp.write("\n")
-                prev_key = k[0]
-
-            p = self.parsing_table[k]
-            fp.write("(%s, %s): %s\n" %
-                     (k[0].name, k[1].name, str(p)))
+        # Sort non-terminals and terminals such that each row of the
+        # table is printed as a group in the order of names
+        nt_list = list(self.non_terminal_list)
+        nt_list.sort()
+        t_list = Terminal.TERMINAL_LIST[:self.terminal_count]
+        t_list.sort()
+
+        # Each row is formatted into one block, and blocks are
+        # separated by new lines
+        block_list = []
+        for nt in nt_list:
+            row = self.parsing_table[nt.id * self.terminal_count:
+                                     (nt.id + 1) * self.terminal_count]
+            line_list = ["(%s, %s): %s\n" % (nt.name, t.name, str(row[t.id]))
+                         for t in t_list
+                         if row[t.id] is not None]
+            if len(line_list) != 0:
+                block_list.append("".join(line_list))
 
+        fp = open(file_name, "w")
+        fp.write("\n".join(block_list))
         fp.close()
 
         return
@@ -3167,6 +3566,7 @@ class ParserGeneratorLL1(ParserGenerator):
         :return: None
         """
         # This checks both condition
+        self.process_first_rhs_set()
         for symbol in self.non_terminal_set:
             if symbol.exists_indirect_left_recursion() is True:
                 raise ValueError("Left recursion is detected" +
@@ -3176,7 +3576,7 @@ class ParserGeneratorLL1(ParserGenerator):
         # This checks condition 5
         for p in self.production_set:
             for symbol in p.rhs_list:
-                if symbol == Symbol.get_empty_symbol():
+                if symbol is EPS:
                     if len(p.rhs_list) != 1:
                         raise ValueError("Empty string in the" +
                                          " middle of production")
@@ -3194,33 +3594,57 @@ class ParserGeneratorLL1(ParserGenerator):
 
         # This checks condition 7
         for symbol in self.non_terminal_set:
-            assert(Symbol.get_empty_symbol() not in symbol.follow_set)
+            assert(symbol.follow_set & EPS.mask == 0)
 
         # This checks condition 3
         for symbol in self.non_terminal_set:
-            # Make it a list to support enumeration
-            lhs = list(symbol.lhs_set)
+            lhs = symbol.lhs_list
             size = len(lhs)
 
+            # FIRST sets are pairwise disjoint if and only if the size
+            # of their union is the sum of their sizes, which is checked
+            # in one pass. Pairs are only compared to report a conflict
+            union_set = 0
+            size_sum = 0
+            for p in lhs:
+                union_set |= p.first_set
+                size_sum += bin(p.first_set).count("1")
+
+            if bin(union_set).count("1") == size_sum:
+                continue
+
             for i in range(1, size):
                 for j in range(0, i):
                     # This is the intersection of both sets
-                    s = lhs[i].first_set.intersection(lhs[j].first_set)
-                    if len(s) != 0:
+                    s = lhs[i].first_set & lhs[j].first_set
+                    if s != 0:
                         raise ValueError(
                             ("The intersection of %s's first_set is not empty\n" +
                              "  %s (%s)\n  %s (%s)") %
                             (str(symbol),
                              str(lhs[i]),
-                             str(lhs[i].first_set),
+                             str(Symbol.expand_symbol_set(lhs[i].first_set)),
                              str(lhs[j]),
-                             str(lhs[j].first_set)))
+                             str(Symbol.expand_symbol_set(lhs[j].first_set))))
 
         # This checks condition 4
         for symbol in self.non_terminal_set:
-            lhs = list(symbol.lhs_set)
+            lhs = symbol.lhs_list
             size = len(lhs)
 
+            # There could only be a conflict if some production derives
+            # empty string and some FIRST set overlaps the FOLLOW set
+            union_set = 0
+            has_nullable = False
+            for p in lhs:
+                union_set |= p.first_set
+                if p.nullable is True:
+                    has_nullable = True
+
+            if has_nullable is False or \
+               union_set & symbol.follow_set == 0:
+                continue
+
             for i in range(1, size):
                 for j in range(0, i):
                     # These two are two productions
@@ -3229,18 +3653,18 @@ class ParserGeneratorLL1(ParserGenerator):
 
                     # If pi could derive empty string then FIRST(pj)
                     # and follow A are disjoint
-                    if Symbol.get_empty_symbol() in pi.first_set:
-                        t = pj.first_set.intersection(symbol.follow_set)
-                        if len(t) != 0:
+                    if pi.nullable is True:
+                        t = pj.first_set & symbol.follow_set
+                        if t != 0:
                             raise ValueError(
                                 "FIRST/FOLLOW conflict for %s on: \n  %s\n  %s" %
                                 (str(symbol),
                                  str(pi),
                                  str(pj)))
 
-                    if Symbol.get_empty_symbol() in pj.first_set:
-                        t = pi.first_set.intersection(symbol.follow_set)
-                        if len(t) != 0:
+                    if pj.nullable is True:
+                        t = pi.first_set & symbol.follow_set
+                        if t != 0:
                             raise ValueError(
                                 "FIRST/FOLLOW conflict for %s on: \n  %s\n  %s" %
                                 (str(symbol),
@@ -3381,7 +3805,7 @@ class ParserLR(ParserGeneratorLR):
             if self.is_typedefed(token.data) is False:
                 return token
 
-            print "Rename %s to typedef name" % (token.data, )
+            print("Rename %s to typedef name" % (token.data, ))
 
             # Change it to T_TYPEDEF_NAME
             ret_token = Token("T_TYPEDEF_NAME", token.data)
@@ -3460,7 +3884,7 @@ class ParserLR(ParserGeneratorLR):
 
         :return: None
         """
-        print "enter scope"
+        print("enter scope")
         self.scope_stack.append(set())
         return
 
@@ -3473,10 +3897,10 @@ class ParserLR(ParserGeneratorLR):
 
         :return: None
         """
-        print "leave scope"
+        print("leave scope")
         assert(len(self.scope_stack) != 0)
         self.scope_stack.pop()
-        print "Scope stack after leaving:", self.scope_stack
+        print("Scope stack after leaving:", self.scope_stack)
 
         return
 
@@ -3522,7 +3946,7 @@ class ParserLR(ParserGeneratorLR):
 
         # Otherwise just add it into the symbol set
         top_level.add(name)
-        print "added typedef name", name
+        print("added typedef name", name)
 
         return True
 
@@ -3570,7 +3994,7 @@ class ParserLR(ParserGeneratorLR):
             token = \
                 line[line.find("=") + 1:line.find(";")].strip()
 
-            ret_list.append(Terminal(token))
+            ret_list.append(Terminal.intern(token))
 
         dbg_printf("Read %d tokens from %s",
                    len(ret_list),
@@ -3631,7 +4055,7 @@ class ParserLR(ParserGeneratorLR):
                 if ast_rule is None:
                     sn = SyntaxNode(reduce_to)
                     # The third component is the pop length
-                    sn.child_list = symbol_stack[-reduce_length:]
+                    sn.set_child_list(symbol_stack[-reduce_length:])
                 else:
                     # Whether the root node is a new string or
                     # an existing node
@@ -3668,8 +4092,10 @@ class ParserLR(ParserGeneratorLR):
                                 symbol_stack[-reduce_length +
                                              root_name[1]].data
 
-                    # Then add its children nodes
+                    # Then add its children nodes. They are collected
+                    # first and added to the root node at once
                     if child_list is not None:
+                        new_child_list = []
                         for child in child_list:
                             # If this is a symbol from the stack then
                             # add it as the child node
@@ -3681,12 +4107,12 @@ class ParserLR(ParserGeneratorLR):
                                 assert(node.parent is None)
                                 node.parent = sn
 
-                                sn.append(node)
+                                new_child_list.append(node)
                             elif isinstance(child, str) is True:
                                 new_node = SyntaxNode(child)
                                 new_node.parent = sn
                                 # If it is a new name then add it also
-                                sn.append(new_node)
+                                new_child_list.append(new_node)
                             else:
                                 # Otherwise it is a new symbol but we need the
                                 # token data also
@@ -3696,7 +4122,9 @@ class ParserLR(ParserGeneratorLR):
                                     symbol_stack[-reduce_length + child[1]].data
                                 # Assign the parent node
                                 new_node.parent = sn
-                                sn.append(new_node)
+                                new_child_list.append(new_node)
+
+                        sn.extend_children(new_child_list)
 
                 # Remove the same number of elements
                 for _ in range(0, reduce_length):
@@ -4146,7 +4574,7 @@ class ParserEarley(ParserGenerator):
         for child_list in item.child_list_list:
             # If it is a terminal then just append it to the syntax node
             if isinstance(item.p[rhs_index], Terminal) is True:
-                sn.append(SyntaxNode(item.p[rhs_index].name))
+                sn.append(SyntaxNode.get_or_make(item.p[rhs_index].name))
                 # Consumed one non-terminal
                 next_token_index += 1
                 # Also consider the next slot in the production
@@ -4271,15 +4699,126 @@ class ParserGeneratorTestCase(DebugRunTestCaseBase):
         prefix = " " * ident
 
         if not isinstance(t, SyntaxNode):
-            print prefix + str(t)
+            print(prefix + str(t))
         else:
-            print prefix + str(t)
+            print(prefix + str(t))
             for symbol in t.child_list:
                 ParserGeneratorTestCase.print_parse_tree(symbol,
                                                          ident + 1)
 
         return
 
+    @staticmethod
+    def trace_ll_parse(pg, terminal_list, root_symbol, trace=False):
+        """
+        Parses a list of terminals with an LL(1) parser generator by
+        looking up every step with get_production() on a stack of
+        symbol objects. This is slower than parse_terminal_list() but
+        could print the stack before each step
+
+        :param pg: The ParserGeneratorLL1 object
+        :param terminal_list: The list of Terminal objects
+        :param root_symbol: The NonTerminal object to start with
+        :param trace: Whether to print the stack for every step
+        :return: int, the number of terminals consumed
+        """
+        index = 0
+        step = 1
+
+        # We use a stack to mimic the behavior of the parser
+        stack = [root_symbol]
+        while len(stack) > 0:
+            if trace is True:
+                print(step, stack)
+
+            step += 1
+            top = stack.pop()
+
+            # Empty symbols could still be popped at the end of input
+            if index == len(terminal_list) and top is not EPS:
+                raise ValueError("Unexpected end of input @ %d" %
+                                 (index, ))
+
+            if top.is_terminal() is True:
+                if top is EPS:
+                    # Empty symbol does not consume any
+                    # tokens in the token stream
+                    continue
+                elif top is terminal_list[index]:
+                    index += 1
+                    continue
+                else:
+                    raise ValueError("Could not match token: %s @ %d" %
+                                     (str(terminal_list[index]), index))
+
+            p = pg.get_production(top, terminal_list[index])
+            if p is None:
+                if trace is True:
+                    dbg_printf("Pair %s (index %d) not in parsing table",
+                               (top, terminal_list[index]),
+                               index)
+                raise ValueError("Could not find entry in parsing table")
+
+            stack.extend(p.rhs_reversed)
+
+        return index
+
+    @staticmethod
+    def derive_terminal_list(pg, rand, max_depth):
+        """
+        Derives a random sentence from the root symbol of the grammar.
+        Below the given depth the production that ends the derivation
+        in the fewest steps is always chosen, such that the derivation
+        is finite
+
+        :param pg: The parser generator
+        :param rand: The random.Random object
+        :param max_depth: The depth to stop choosing randomly
+        :return: list(Terminal), which does not end with EOF
+        """
+        # This is the height of the smallest derivation tree of every
+        # non-terminal, computed as a fixed point
+        height_dict = {}
+        changed = True
+        while changed is True:
+            changed = False
+            for p in pg.production_set:
+                height = 0
+                for symbol in p.rhs_list:
+                    if symbol.is_terminal() is True:
+                        continue
+                    elif symbol not in height_dict:
+                        break
+
+                    height = max(height, height_dict[symbol])
+                else:
+                    if height_dict.get(p.lhs, height + 2) > height + 1:
+                        height_dict[p.lhs] = height + 1
+                        changed = True
+
+        def production_height(p):
+            return max([height_dict[symbol] for symbol in p.rhs_list
+                        if symbol.is_non_terminal() is True] + [0])
+
+        ret = []
+        stack = [(pg.root_symbol, 0)]
+        while len(stack) != 0:
+            symbol, depth = stack.pop()
+            if symbol.is_terminal() is True:
+                if symbol is not EPS:
+                    ret.append(symbol)
+                continue
+
+            if depth < max_depth:
+                p = rand.choice(symbol.lhs_list)
+            else:
+                p = min(symbol.lhs_list, key=production_height)
+
+            for rhs in p.rhs_reversed:
+                stack.append((rhs, depth + 1))
+
+        return ret
+
     @TestNode("test_lr")
     def test_lr_parse(self, argv):
         """
@@ -4315,10 +4854,113 @@ class ParserGeneratorTestCase(DebugRunTestCaseBase):
 
         return
 
+    @staticmethod
+    def find_syntax_node(root, symbol, outermost=False):
+        """
+        Returns syntax nodes of the given symbol in the AST in
+        pre-order
+
+        :param root: The root of the AST
+        :param symbol: The symbol string
+        :param outermost: If True then nodes under another node of the
+                          symbol are not returned
+        :return: list(SyntaxNode)
+        """
+        ret = []
+        stack = [root]
+        while len(stack) != 0:
+            node = stack.pop()
+            if isinstance(node, SyntaxNode) is False:
+                continue
+            elif node.symbol == symbol:
+                ret.append(node)
+                if outermost is True:
+                    continue
+
+            stack.extend(reversed(node.child_list))
+
+        return ret
+
+    @TestNode("test_lr")
+    def test_register_transform(self, argv):
+        """
+        Tests that a routine registered for the symbol of nodes in an
+        existing AST transforms all of them in pre-order, and that
+        children of a replaced node are not transformed
+
+        :param argv: Argument vector
+        :return: None
+        """
+        if argv.has_keys("lr") is False:
+            dbg_printf("Please use --lr to test AST transformation")
+            return
+
+        if argv.has_keys("token-file") is False:
+            dbg_printf("Please use --token-file to specify lex output")
+            return
+
+        token_file_name = argv.get_all_values("token-file")[0]
+        root = self.pg.parse(token_file_name)
+        assert(root is not None)
+
+        # Tokens could also be children, and they are never transformed
+        root.set_child_list(root.child_list +
+                            [Token("T_IDENT", "token_leaf")])
+
+        symbol = "T_DECL_BODY"
+        node_list = ParserGeneratorTestCase.find_syntax_node(root, symbol)
+        assert(len(node_list) != 0)
+
+        # The transform table is shared by all syntax nodes, so it is
+        # restored after the test
+        assert(symbol not in TRANSFORM_DICT)
+        saved_table = (list(SYMBOL_LIST),
+                       dict(SYMBOL_ID),
+                       list(TRANSFORM_TABLE),
+                       dict(TRANSFORM_DICT))
+
+        # Syntax nodes could only be compared with strings, so the
+        # lists below are compared by identity
+        visited_list = []
+        def visit(node):
+            visited_list.append(node)
+            return node
+
+        SyntaxNode.register_transform(symbol, visit, root)
+        assert(transform_ast(root) is root)
+        assert(len(visited_list) == len(node_list))
+        assert(all([a is b for a, b in zip(visited_list, node_list)]))
+
+        # Replacing a node also replaces its subtree, so only the
+        # outermost nodes are visited
+        node_list = \
+            ParserGeneratorTestCase.find_syntax_node(root, symbol, True)
+        visited_list = []
+        def replace(node):
+            visited_list.append(node)
+            return SyntaxNode("T_REPLACED")
+
+        SyntaxNode.register_transform(symbol, replace, root)
+        assert(transform_ast(root) is root)
+        assert(len(visited_list) == len(node_list))
+        assert(all([a is b for a, b in zip(visited_list, node_list)]))
+        assert(len(ParserGeneratorTestCase.find_syntax_node(root,
+                                                            symbol)) == 0)
+
+        SyntaxNode.unregister_transform(symbol, root)
+        assert(saved_table == (SYMBOL_LIST,
+                               SYMBOL_ID,
+                               TRANSFORM_TABLE,
+                               TRANSFORM_DICT))
+
+        return
+
     @TestNode("test_ll")
     def test_ll_parse(self, argv):
         """
-        Interactive mode to display how a string is parsed
+        Parses a string with the LL(1) parsing table. With --trace
+        the stack is printed for every step to display how the string
+        is parsed
 
         :param argv: Argument vector
         :return: None
@@ -4328,64 +4970,101 @@ class ParserGeneratorTestCase(DebugRunTestCaseBase):
             return
 
         pg = self.pg
-        pt = pg.parsing_table
 
         # It's like the following:
         # *p + a * b ? func(1, c * *q) : 2
 
-        test_str = [Terminal("T_STAR"),
-                    Terminal("T_IDENT"),
-                    Terminal("T_PLUS"),
-                    Terminal("T_IDENT"),
-                    Terminal("T_STAR"),
-                    Terminal("T_IDENT"),
-                    Terminal("T_QMARK"),
-                    Terminal("T_IDENT"),
-                    Terminal("T_LPAREN"),
-                    Terminal("T_INT_CONST"),
-                    Terminal("T_COMMA"),
-                    Terminal("T_IDENT"),
-                    Terminal("T_STAR"),
-                    Terminal("T_STAR"),
-                    Terminal("T_IDENT"),
-                    Terminal("T_RPAREN"),
-                    Terminal("T_COLON"),
-                    Terminal("T_INT_CONST"),
-                    Symbol.get_end_symbol()]
+        test_str = [Terminal.intern("T_STAR"),
+                    Terminal.intern("T_IDENT"),
+                    Terminal.intern("T_PLUS"),
+                    Terminal.intern("T_IDENT"),
+                    Terminal.intern("T_STAR"),
+                    Terminal.intern("T_IDENT"),
+                    Terminal.intern("T_QMARK"),
+                    Terminal.intern("T_IDENT"),
+                    Terminal.intern("T_LPAREN"),
+                    Terminal.intern("T_INT_CONST"),
+                    Terminal.intern("T_COMMA"),
+                    Terminal.intern("T_IDENT"),
+                    Terminal.intern("T_STAR"),
+                    Terminal.intern("T_STAR"),
+                    Terminal.intern("T_IDENT"),
+                    Terminal.intern("T_RPAREN"),
+                    Terminal.intern("T_COLON"),
+                    Terminal.intern("T_INT_CONST"),
+                    EOF]
+
+        root_symbol = pg.symbol_dict["expression"]
+        if argv.has_keys("trace") is True:
+            # Print the stack for every step
+            index = ParserGeneratorTestCase.trace_ll_parse(pg,
+                                                           test_str,
+                                                           root_symbol,
+                                                           True)
+        else:
+            index = pg.parse_terminal_list(test_str, root_symbol)
 
-        index = 0
-        step = 1
+        dbg_printf("Consumed %d terminals", index)
 
-        # We use a stack to mimic the behavior of the parser
-        stack = [NonTerminal("expression")]
-        while len(stack) > 0:
-            print step, stack
+        return
 
-            step += 1
-            top = stack.pop()
+    @TestNode("test_ll")
+    def test_ll_driver(self, argv):
+        """
+        Checks that parse_terminal_list() agrees with looking up
+        get_production() for every step, on random sentences of the
+        grammar and on the same sentences with one terminal replaced
 
-            if top.is_terminal() is True:
-                if top == Symbol.get_empty_symbol():
-                    # Empty symbol does not consume any
-                    # tokens in the token stream
-                    continue
-                elif top == test_str[index]:
-                    index += 1
-                    continue
-                else:
-                    raise ValueError("Could not match token: %s @ %d" %
-                                     (str(test_str[index]), index))
+        :param argv: Argument vector
+        :return: None
+        """
+        if argv.has_keys("ll") is False:
+            dbg_printf("Please use --ll to test LL(1) parser generator")
+            return
 
-            pair = (top, test_str[index])
-            if pair not in pt:
-                dbg_printf("Pair %s (index %d) not in parsing table",
-                           pair,
-                           index)
-                raise ValueError("Could not find entry in parsing table")
+        pg = self.pg
+        root_symbol = pg.root_symbol
+        terminal_list = sorted(pg.terminal_set)
+        # Use a fixed seed such that the test is repeatable
+        rand = random.Random(1)
+
+        error_count = 0
+        for i in range(200):
+            test_str = ParserGeneratorTestCase.derive_terminal_list(pg,
+                                                                    rand,
+                                                                    8)
+            # Replace one terminal for every other sentence, which
+            # usually makes it invalid
+            if i % 2 == 1 and len(test_str) != 0:
+                test_str[rand.randrange(len(test_str))] = \
+                    rand.choice(terminal_list)
+
+            # Without EOF the input may run out before the stack is
+            # empty, which must also be rejected with ValueError
+            for end in (None, EOF):
+                if end is not None:
+                    test_str.append(end)
+
+                try:
+                    expected = ParserGeneratorTestCase.trace_ll_parse(
+                        pg, test_str, root_symbol)
+                except ValueError:
+                    expected = None
+
+                try:
+                    index = pg.parse_terminal_list(test_str, root_symbol)
+                except ValueError:
+                    index = None
+
+                assert(index == expected)
 
-            p = pt[pair]
-            for i in reversed(p.rhs_list):
-                stack.append(i)
+            if index is None:
+                error_count += 1
+            elif i % 2 == 0:
+                # Valid sentences are consumed up to EOF
+                assert(index == len(test_str) - 1)
+
+        dbg_printf("%d of 200 sentences are rejected", error_count)
 
         return
 
@@ -4421,9 +5100,9 @@ class ParserGeneratorTestCase(DebugRunTestCaseBase):
 
         for p in pg.production_set:
             if p.first_set != p.compute_substring_first():
-                print p
-                print p.first_set
-                print p.compute_substring_first()
+                print(p)
+                print(Symbol.expand_symbol_set(p.first_set))
+                print(Symbol.expand_symbol_set(p.compute_substring_first()))
 
             assert(p.first_set == p.compute_substring_first())
 
@@ -4455,15 +5134,24 @@ class ParserGeneratorTestCase(DebugRunTestCaseBase):
         # and parse its contents
         # If no parser type is specified then we just think
         # the file given is the parsing table
+        # With --cache the generated table is kept next to the syntax
+        # file and reused until the syntax file changes
+        cache_file_name = None
+        if argv.has_keys("cache"):
+            cache_file_name = file_name + ".cache"
+
         if argv.has_keys("slr"):
             self.pg = ParserGeneratorLR(file_name,
-                                        ParserGeneratorLR.LR_TYPE_SLR)
+                                        ParserGeneratorLR.LR_TYPE_SLR,
+                                        cache_file_name)
         elif argv.has_keys("lr1"):
             self.pg = ParserGeneratorLR(file_name,
-                                        ParserGeneratorLR.LR_TYPE_LR1)
+                                        ParserGeneratorLR.LR_TYPE_LR1,
+                                        cache_file_name)
         elif argv.has_keys("lalr"):
             self.pg = ParserGeneratorLR(file_name,
-                                        ParserGeneratorLR.LR_TYPE_LALR)
+                                        ParserGeneratorLR.LR_TYPE_LALR,
+                                        cache_file_name)
         elif argv.has_keys("lr"):
             # If no parser type is specified just load the parsing
             # table
@@ -4482,6 +5170,101 @@ class ParserGeneratorTestCase(DebugRunTestCaseBase):
 
         return
 
+    @staticmethod
+    def count_lr_table_entries(parsing_table):
+        """
+        Counts entries of an LR parsing table by symbol, action and
+        reduce data. State numbers are left out because they depend on
+        the order item sets are built in
+
+        :param parsing_table: The parsing table dict
+        :return: collections.Counter
+        """
+        ret = collections.Counter()
+        for key, value in parsing_table.items():
+            if value[0] == ParserGeneratorLR.ACTION_REDUCE:
+                data = repr(value[1:])
+            else:
+                data = None
+
+            ret[(key[1], value[0], data)] += 1
+
+        return ret
+
+    @TestNode()
+    def test_lr_cache(self, argv):
+        """
+        Tests that the cached parsing table is used if the syntax file
+        has not changed, and is rebuilt and saved again if it has. The
+        syntax file is copied into a temporary directory such that the
+        cache file next to it is not touched
+
+        :param argv: Argument vector
+        :return: None
+        """
+        if argv.has_keys("cache") is False:
+            dbg_printf("Please use --cache with --lr1 or --slr or --lalr" +
+                       " to test parsing table cache")
+            return
+
+        if argv.has_keys("slr"):
+            lr_type = ParserGeneratorLR.LR_TYPE_SLR
+        elif argv.has_keys("lr1"):
+            lr_type = ParserGeneratorLR.LR_TYPE_LR1
+        elif argv.has_keys("lalr"):
+            lr_type = ParserGeneratorLR.LR_TYPE_LALR
+        else:
+            dbg_printf("Please use --lr1 or --slr or --lalr to" +
+                       " test parsing table cache")
+            return
+
+        file_name = argv.arg_list[0]
+        temp_dir = tempfile.mkdtemp()
+        try:
+            syntax_file_name = \
+                os.path.join(temp_dir, os.path.basename(file_name))
+            cache_file_name = syntax_file_name + ".cache"
+            shutil.copy(file_name, syntax_file_name)
+
+            # There is no cache file, so the table is built and saved
+            pg = ParserGeneratorLR(syntax_file_name,
+                                   lr_type,
+                                   cache_file_name)
+            assert(len(pg.item_set_list) != 0)
+            assert(os.path.isfile(cache_file_name) is True)
+
+            # Then the same table is loaded without building item sets
+            cached_pg = ParserGeneratorLR(syntax_file_name,
+                                          lr_type,
+                                          cache_file_name)
+            assert(len(cached_pg.item_set_list) == 0)
+            assert(cached_pg.starting_state == pg.starting_state)
+            assert(cached_pg.parsing_table == pg.parsing_table)
+
+            # Any change to the syntax file makes the cache stale, even
+            # if it is only a comment
+            fp = open(syntax_file_name, "a")
+            fp.write("\n# This makes the cache stale\n")
+            fp.close()
+
+            stale_pg = ParserGeneratorLR(syntax_file_name,
+                                         lr_type,
+                                         cache_file_name)
+            assert(len(stale_pg.item_set_list) != 0)
+            assert(ParserGeneratorTestCase.count_lr_table_entries(
+                       stale_pg.parsing_table) ==
+                   ParserGeneratorTestCase.count_lr_table_entries(
+                       pg.parsing_table))
+
+            # The cache file has been saved again with the new key
+            cache_key = cached_pg.get_cache_key(syntax_file_name)
+            assert(cached_pg.load_cache(cache_file_name, cache_key) is True)
+            assert(cached_pg.parsing_table == stale_pg.parsing_table)
+        finally:
+            shutil.rmtree(temp_dir)
+
+        return
+
     @classmethod
     @TestNode()
     def test_earley_parse(cls, argv):